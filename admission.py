@@ -0,0 +1,287 @@
+import asyncio
+import heapq
+import logging
+from collections import deque
+from itertools import count
+from threading import Condition, Thread
+from time import monotonic
+
+# priority classes in the order they're probed, critical probes are never shed or stretched
+PRIORITIES = ('critical', 'normal', 'low')
+RANKS = {priority: rank for rank, priority in enumerate(PRIORITIES)}
+
+# how far the interval of a shed class can be stretched under overload
+MAX_STRETCH = 8
+
+
+class Probe:
+    # a released probe of a probe group, due before its next release
+    __slots__ = ('key', 'priority', 'release', 'deadline')
+
+    def __init__(self, key: str, priority: str, release: float, deadline: float):
+        self.key = key
+        self.priority = priority
+        self.release = release
+        self.deadline = deadline
+
+
+class ClassStats:
+    __slots__ = ('released', 'coalesced', 'stretched', 'shed', 'probed', 'late', 'stretch', 'stretchedAt', 'delays')
+
+    def __init__(self):
+        self.released = self.coalesced = self.stretched = self.shed = self.probed = self.late = 0
+        # only every `stretch`th release of the class is probed
+        self.stretch = 1
+        self.stretchedAt = float('-inf')
+        # seconds from release to the end of the probe
+        self.delays = deque(maxlen=1000)
+
+    def percentile(self, pct: float):
+        if not self.delays:
+            return None
+        values = sorted(self.delays)
+        return round(values[min(len(values) - 1, int(len(values) * pct / 100))], 3)
+
+    def report(self):
+        return {
+            'released': self.released,
+            'probed': self.probed,
+            'deadlineMisses': self.late + self.shed,
+            'late': self.late,
+            'shed': self.shed,
+            'skipped': self.coalesced + self.stretched,
+            'stretch': self.stretch,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+        }
+
+
+class ProbeDispatcher:
+    """
+    Admission control for the health check probes when there are more of them than workers to run them.
+
+    The scheduler only releases probes, each is due before the next release of its group (its interval).
+    Workers take the probe of the most urgent class with the earliest deadline.  A probe of a class that
+    isn't critical that has missed its deadline before a worker gets to it is shed, which also doubles
+    how much that class's intervals are stretched (only every `stretch`th release is admitted).  The
+    stretch halves again each time a probe of the class is done on time with nothing waiting.
+    A release is skipped while the previous probe of the group is still waiting.
+    """
+
+    def __init__(self):
+        self.queue = []
+        self.queued = set()
+        self.releases = {}
+        self.seq = count()
+        self.ready = Condition()
+        self.wakeup = None
+        self.classes = {priority: ClassStats() for priority in PRIORITIES}
+
+    def submit(self, key: str, priority: str, interval: float, now: float = None):
+        """
+        Release a probe of a probe group.
+
+        Returns:
+            bool: True if the probe was queued, False if it was skipped
+        """
+        now = monotonic() if now is None else now
+        with self.ready:
+            stats = self.classes[priority]
+            stats.released += 1
+            if key in self.queued:
+                stats.coalesced += 1
+                return False
+            releases = self.releases[key] = self.releases.get(key, 0) + 1
+            if releases % stats.stretch:
+                stats.stretched += 1
+                return False
+            probe = Probe(key, priority, now, now + interval)
+            heapq.heappush(self.queue, (RANKS[priority], probe.deadline, next(self.seq), probe))
+            self.queued.add(key)
+            self.ready.notify()
+        if self.wakeup is not None:
+            self.wakeup.set()
+        return True
+
+    def forget(self, key: str):
+        # the probe group is gone, a probe still waiting is dropped when it comes up
+        with self.ready:
+            self.releases.pop(key, None)
+
+    def next(self, now: float = None):
+        # the next probe to run, None if there isn't one
+        now = monotonic() if now is None else now
+        with self.ready:
+            while self.queue:
+                probe = heapq.heappop(self.queue)[-1]
+                self.queued.discard(probe.key)
+                if probe.key not in self.releases:
+                    continue
+                stats = self.classes[probe.priority]
+                if probe.priority != PRIORITIES[0] and now > probe.deadline:
+                    stats.shed += 1
+                    # the probes released before the last stretch don't stretch it any further
+                    if probe.release >= stats.stretchedAt and stats.stretch < MAX_STRETCH:
+                        stats.stretch *= 2
+                        stats.stretchedAt = now
+                        logging.warning(f"Overloaded, {probe.priority} probes stretched to every {stats.stretch} intervals.")
+                    continue
+                return probe
+        return None
+
+    def done(self, probe: Probe, now: float = None):
+        now = monotonic() if now is None else now
+        with self.ready:
+            stats = self.classes[probe.priority]
+            stats.probed += 1
+            stats.delays.append(now - probe.release)
+            if now > probe.deadline:
+                stats.late += 1
+            elif stats.stretch > 1 and not self.queue:
+                stats.stretch //= 2
+                stats.stretchedAt = now
+                logging.info(f"{probe.priority.capitalize()} probes stretched to every {stats.stretch} intervals.")
+
+    def get(self):
+        # block until there is a probe to run
+        with self.ready:
+            while True:
+                probe = self.next()
+                if probe is not None:
+                    return probe
+                self.ready.wait()
+
+    def serve(self, run, workers: int):
+        # run the probes in daemon threads, `run(key)` probes a group
+        def work():
+            while True:
+                probe = self.get()
+                try:
+                    run(probe.key)
+                except Exception:
+                    logging.exception(f'Probing {probe.key} failed.')
+                finally:
+                    self.done(probe)
+
+        for worker in range(workers):
+            Thread(target=work, name=f'probe-{worker}', daemon=True).start()
+        logging.info(f'Running probes with {workers} workers.')
+
+    def serveAsync(self, run, workers: int):
+        # run the probes as tasks of the running event loop, `run(key)` is a coroutine probing a group
+        self.wakeup = asyncio.Event()
+
+        async def work():
+            while True:
+                probe = self.next()
+                if probe is None:
+                    self.wakeup.clear()
+                    await self.wakeup.wait()
+                    continue
+                try:
+                    await run(probe.key)
+                except Exception:
+                    logging.exception(f'Probing {probe.key} failed.')
+                finally:
+                    self.done(probe)
+
+        logging.info(f'Running probes with {workers} workers.')
+        return [asyncio.ensure_future(work()) for _ in range(workers)]
+
+    def stats(self):
+        with self.ready:
+            return {'waiting': len(self.queue), **{priority: stats.report() for priority, stats in self.classes.items()}}
+
+
+if __name__ == '__main__':
+    from random import Random
+
+    logging.disable(logging.WARNING)
+
+    # critical first, then earliest deadline
+    dispatcher = ProbeDispatcher()
+    assert dispatcher.submit('low', 'low', 10, now=0)                                      # nosec
+    assert dispatcher.submit('normal-late', 'normal', 30, now=0)                           # nosec
+    assert dispatcher.submit('normal-soon', 'normal', 5, now=0)                            # nosec
+    assert dispatcher.submit('critical', 'critical', 60, now=0)                            # nosec
+    assert not dispatcher.submit('critical', 'critical', 60, now=1)                        # nosec
+    order = [dispatcher.next(now=1).key for _ in range(4)]
+    assert order == ['critical', 'normal-soon', 'normal-late', 'low'], order               # nosec
+    assert dispatcher.next(now=1) is None                                                  # nosec
+
+    # late probes that aren't critical are shed and their class stretched, critical ones are only late
+    dispatcher.submit('low', 'low', 10, now=20)
+    dispatcher.submit('critical', 'critical', 10, now=20)
+    critical = dispatcher.next(now=40)
+    assert critical.key == 'critical' and dispatcher.next(now=40) is None                  # nosec
+    dispatcher.done(critical, now=41)
+    stats = dispatcher.stats()
+    assert stats['low']['shed'] == 1 and stats['low']['stretch'] == 2                      # nosec
+    assert stats['critical']['late'] == 1 and stats['critical']['stretch'] == 1            # nosec
+    assert not dispatcher.submit('low', 'low', 10, now=50)                                 # nosec
+    assert dispatcher.submit('low', 'low', 10, now=60)                                     # nosec
+    dispatcher.done(dispatcher.next(now=61), now=62)
+    assert dispatcher.stats()['low']['stretch'] == 1                                       # nosec
+
+    def simulate(fifo: bool, workers: int = 10, duration: float = 3600, seed: int = 1):
+        # discrete event simulation of apps failing while the probes are 2x over capacity,
+        # returns the detection latency of each critical app and the dispatcher stats.
+        # fifo is how the scheduler's thread pool runs jobs, skipping a job still waiting or running
+        rand = Random(seed)
+        dispatcher, fifoQueue, fifoPending = ProbeDispatcher(), deque(), set()
+        # (priority, interval, count): 40 probes/sec offered, 10 workers at 0.5s a probe can do 20/sec
+        groups = [('critical', 10, 100), ('normal', 30, 300), ('low', 30, 600)]
+        events, failures, detected = [], {}, {}
+        for priority, interval, groupCount in groups:
+            for i in range(groupCount):
+                key = f'{priority}{i}'
+                heapq.heappush(events, (rand.uniform(0, interval), 1, key, priority, interval))
+                if priority == 'critical':
+                    failures[key] = rand.uniform(600, duration - 600)
+        idle = workers
+        while events:
+            now, kind, key, priority, interval = heapq.heappop(events)
+            if now > duration:
+                break
+            if kind == 0:
+                # a worker finished a probe, its `priority` is the dispatched probe
+                idle += 1
+                if fifo:
+                    fifoPending.discard(key)
+                else:
+                    dispatcher.done(priority, now)
+            else:
+                # the scheduler released a probe
+                heapq.heappush(events, (now + interval, 1, key, priority, interval))
+                if fifo:
+                    if key not in fifoPending:
+                        fifoPending.add(key)
+                        fifoQueue.append(key)
+                else:
+                    dispatcher.submit(key, priority, interval, now)
+            while idle:
+                probe = (fifoQueue.popleft() if fifoQueue else None) if fifo else dispatcher.next(now)
+                if probe is None:
+                    break
+                idle -= 1
+                probeKey = probe if fifo else probe.key
+                finished = now + rand.expovariate(2)
+                if probeKey in failures and probeKey not in detected and failures[probeKey] <= now:
+                    detected[probeKey] = finished - failures[probeKey]
+                heapq.heappush(events, (finished, 0, probeKey, probe, 0))
+        return [detected.get(key, duration - failure) for key, failure in failures.items()], dispatcher.stats()
+
+    def summary(latencies):
+        latencies = sorted(latencies)
+        return (f'p50 {latencies[len(latencies) // 2]:.1f}s p95 {latencies[int(len(latencies) * 0.95)]:.1f}s '
+                f'max {latencies[-1]:.1f}s')
+
+    fifoLatencies, _ = simulate(fifo=True)
+    latencies, stats = simulate(fifo=False)
+    print('critical apps (10s interval) failure detection latency at 2x overload:')
+    print(f'  fifo:       {summary(fifoLatencies)}')
+    print(f'  dispatcher: {summary(latencies)}')
+    for priority in PRIORITIES:
+        print(f"  {priority:8} {stats[priority]}")
+    # a critical failure is seen within the next interval and a bit of queueing
+    assert max(latencies) < 2 * 10                                                         # nosec
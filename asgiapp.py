@@ -0,0 +1,170 @@
+import asyncio
+import json
+import logging
+from http import HTTPStatus
+from urllib.parse import parse_qsl
+from export import StreamingBody
+
+
+class AsgiApp:
+    """
+    Minimal ASGI application used to serve the HealthChecker api from an asyncio event loop.
+
+    Routes map a path to `(methods, handler)` where the handler is called with a dict of the
+    query string and form parameters and returns `(body, statusCode)`.  A `str` body is sent
+    as text, a `StreamingBody` is sent chunk by chunk and anything else is serialized as JSON
+    with `jsonEncoder`.
+
+    Routes of `(methods, handler, True)` stream the request body instead, the handler is called
+    with the query string parameters and returns a consumer with `feedChunk(bytes)` and
+    `close()` which returns `(body, statusCode)`.
+    """
+
+    def __init__(self, routes: dict, jsonEncoder=json.JSONEncoder):
+        self.routes = routes
+        self.jsonEncoder = jsonEncoder
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.http(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def http(self, scope, receive, send):
+        route = self.routes.get(scope['path'])
+        if route is None:
+            return await self.respond(send, 'Not Found', HTTPStatus.NOT_FOUND)
+        methods, handler, *streamBody = route
+        if scope['method'] not in methods:
+            return await self.respond(send, 'Method Not Allowed', HTTPStatus.METHOD_NOT_ALLOWED)
+
+        params = dict(parse_qsl(scope.get('query_string', b'').decode('latin-1')))
+        if streamBody and streamBody[0]:
+            consumer = handler(params)
+            while True:
+                message = await receive()
+                consumer.feedChunk(message.get('body', b''))
+                if not message.get('more_body', False):
+                    break
+            return await self.respond(send, *consumer.close())
+
+        if scope['method'] == 'POST':
+            body = b''
+            while True:
+                message = await receive()
+                body += message.get('body', b'')
+                if not message.get('more_body', False):
+                    break
+            params.update(parse_qsl(body.decode('utf-8')))
+
+        try:
+            responseBody, statusCode = handler(params)
+        except (KeyError, ValueError) as e:
+            # same as flask does for a missing form key
+            logging.error(f"Bad request to {scope['path']}: {e!r}")
+            responseBody, statusCode = 'Bad Request', HTTPStatus.BAD_REQUEST
+        await self.respond(send, responseBody, statusCode)
+
+    async def respond(self, send, body, statusCode):
+        if isinstance(body, StreamingBody):
+            # no content-length so the server uses chunked transfer encoding
+            await send({
+                'type': 'http.response.start',
+                'status': int(statusCode),
+                'headers': [(b'content-type', body.contentType.encode('latin-1'))],
+            })
+            for chunk in body:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                # the chunks are built synchronously, let the probes and other requests run in between
+                await asyncio.sleep(0)
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+        if isinstance(body, str):
+            contentType = b'text/html; charset=utf-8'
+            payload = body.encode('utf-8')
+        else:
+            contentType = b'application/json'
+            payload = json.dumps(body, cls=self.jsonEncoder).encode('utf-8')
+        await send({
+            'type': 'http.response.start',
+            'status': int(statusCode),
+            'headers': [(b'content-type', contentType), (b'content-length', str(len(payload)).encode())],
+        })
+        await send({'type': 'http.response.body', 'body': payload})
+
+
+if __name__ == '__main__':
+    def echo(params):
+        return params, HTTPStatus.OK
+
+    def required(params):
+        return f"hello {params['appname']}", HTTPStatus.CREATED
+
+    class Counter:
+        def __init__(self):
+            self.size = 0
+
+        def feedChunk(self, chunk):
+            self.size += len(chunk)
+
+        def close(self):
+            return str(self.size), HTTPStatus.OK
+
+    asgiApp = AsgiApp({
+        '/echo': (('GET',), echo),
+        '/required': (('POST',), required),
+        '/stream': (('GET',), lambda params: (StreamingBody([b'a', b'b'], 'text/plain'), HTTPStatus.OK)),
+        '/upload': (('POST',), lambda params: Counter(), True),
+        '/export': (('GET',), lambda params: (StreamingBody((b'x' for _ in range(100)), 'text/plain'), HTTPStatus.OK)),
+    })
+
+    async def call(method, path, query=b'', body=b''):
+        sent = []
+        messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query}
+        await asgiApp(scope, receive, send)
+        return sent[0]['status'], b''.join(message.get('body', b'') for message in sent[1:])
+
+    assert asyncio.run(call('GET', '/echo', b'appname=foo')) == (200, b'{"appname": "foo"}')    # nosec
+    assert asyncio.run(call('GET', '/missing'))[0] == 404                                     # nosec
+    assert asyncio.run(call('GET', '/required'))[0] == 405                                    # nosec
+    assert asyncio.run(call('POST', '/required', body=b'appname=bar')) == (201, b'hello bar')  # nosec
+    assert asyncio.run(call('POST', '/required', body=b'url=bar'))[0] == 400                  # nosec
+    assert asyncio.run(call('GET', '/stream')) == (200, b'ab')                                # nosec
+    assert asyncio.run(call('POST', '/upload', body=b'12345')) == (200, b'5')                 # nosec
+
+    # the event loop keeps running while a streamed body is sent
+    async def exportWhileTicking():
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0)
+
+        ticker = asyncio.create_task(tick())
+        await asyncio.sleep(0)
+        before = ticks
+        response = await call('GET', '/export')
+        ticker.cancel()
+        return response, ticks - before
+
+    response, ticks = asyncio.run(exportWhileTicking())
+    assert response == (200, b'x' * 100) and ticks >= 100, ticks                             # nosec
@@ -0,0 +1,380 @@
+import asyncio
+import logging
+from urllib.parse import urlencode
+from flask_api import status
+from healthcheck import HealthCheckerServer, MonitorValues, monitorParams
+from probe import HttpResponse
+
+# backoff between registration attempts while the HealthChecker Server can't be reached
+MIN_RETRY_INTERVAL = 1
+MAX_RETRY_INTERVAL = 60
+
+
+class HealthCheckerSession:
+    """
+    Pool of keep-alive connections to the HealthChecker Server shared by any number of `AsyncHealthCheckerServer`s.
+
+    The server is found with zeroconf (in an executor so the event loop isn't blocked) unless its
+    `(ip, port)` is passed in.  At most `size` requests are in flight at once.
+    """
+
+    def __init__(self, healthCheckerAddr: tuple = None, size: int = 10, timeout: float = 5):
+        self.healthCheckerAddr = healthCheckerAddr
+        self.discovered = healthCheckerAddr is None
+        self.size = size
+        self.timeout = timeout
+        self.idle = []
+        self.slots = None
+        self.discovering = None
+
+    async def addr(self):
+        if self.healthCheckerAddr is None:
+            # one zeroconf lookup shared by everyone waiting on it, tried again on the next call if it fails
+            if self.discovering is None:
+                self.discovering = asyncio.get_running_loop().run_in_executor(None, HealthCheckerServer.discover)
+            try:
+                self.healthCheckerAddr = await self.discovering
+            finally:
+                self.discovering = None
+        return self.healthCheckerAddr
+
+    async def get(self, endpoint: str, paramsDict: dict):
+        return await self.request('GET', f'{endpoint}?{urlencode(paramsDict)}')
+
+    async def post(self, endpoint: str, formDict: dict):
+        return await self.request('POST', endpoint, urlencode(formDict).encode('utf-8'))
+
+    async def request(self, method: str, endpoint: str, body: bytes = b''):
+        # the status code of the request, HTTP_503_SERVICE_UNAVAILABLE if the server couldn't be reached
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.size)
+        try:
+            addr = await self.addr()
+            if addr is None:
+                return status.HTTP_503_SERVICE_UNAVAILABLE
+            async with self.slots:
+                return await asyncio.wait_for(self.send(addr, method, endpoint, body), self.timeout)
+        except (OSError, asyncio.TimeoutError):
+            if self.discovered:
+                # look the server up again, a standby may have taken over from it
+                self.healthCheckerAddr = None
+            return status.HTTP_503_SERVICE_UNAVAILABLE
+        except (ValueError, asyncio.IncompleteReadError):
+            return status.HTTP_503_SERVICE_UNAVAILABLE
+
+    async def send(self, addr: tuple, method: str, endpoint: str, body: bytes):
+        request = (
+            f'{method} /healthchecker/{endpoint} HTTP/1.1\r\nHost: {addr[0]}:{addr[1]}\r\n'
+            f'Cache-Control: no-cache\r\nContent-Type: application/x-www-form-urlencoded\r\n'
+            f'Content-Length: {len(body)}\r\n\r\n'
+        ).encode('latin-1') + body
+
+        while self.idle:
+            # the server may have closed an idle connection, then try the next one
+            reader, writer = self.idle.pop()
+            try:
+                return await self.exchange(reader, writer, request)
+            except (OSError, ValueError, asyncio.IncompleteReadError):
+                writer.close()
+            except BaseException:
+                # cancelled by the request timeout
+                writer.close()
+                raise
+        reader, writer = await asyncio.open_connection(*addr)
+        try:
+            return await self.exchange(reader, writer, request)
+        except BaseException:
+            writer.close()
+            raise
+
+    async def exchange(self, reader, writer, request: bytes):
+        writer.write(request)
+        await writer.drain()
+        response = HttpResponse()
+        data = await reader.read(65536)
+        if not data:
+            raise asyncio.IncompleteReadError(b'', None)
+        while not response.feed(data):
+            data = await reader.read(65536)
+            if not data:
+                break
+        if response.statusCode is None:
+            raise ValueError('no response from the HealthChecker Server')
+
+        if response.keepAlive and data and (response.contentLength is not None or response.chunked):
+            self.idle.append((reader, writer))
+        else:
+            writer.close()
+        return response.statusCode
+
+    async def close(self):
+        while self.idle:
+            _, writer = self.idle.pop()
+            writer.close()
+
+
+class AsyncHealthCheckerServer:
+    """
+    asyncio version of `HealthCheckerServer` for apps that run in an event loop.
+
+    Apps registering many sub-services should share one `HealthCheckerSession`.  `startMonitoring()` registers
+    in the background so app startup isn't held up by the HealthChecker Server: registration is retried with
+    backoff while the server is unavailable and the app is registered again if the server forgets about it (i.e. it
+    restarted).  A registration the server rejects (i.e. a parameter out of range) is logged and ends the task.
+    Use `close()` (or `async with`) to stop monitoring, there is no `__del__` to block interpreter shutdown.
+    """
+
+    def __init__(self, app: str, url: str, session: HealthCheckerSession = None):
+        self.appname = app
+        self.monitorUrl = url
+        self.session = session or HealthCheckerSession()
+        self.ownsSession = session is None
+        self.params = None
+        # created in the event loop, before python 3.10 an Event is bound to the loop it was created in
+        self.registeredEvent = None
+        self.task = None
+
+    @property
+    def registered(self):
+        if self.registeredEvent is None:
+            self.registeredEvent = asyncio.Event()
+        return self.registeredEvent
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def monitor(self,
+                      emailAddr: str = "",
+                      timeout: int = MonitorValues.DEFAULT_TIME_OUT,
+                      interval: int = MonitorValues.DEFAULT_INTERVAL,
+                      unhealthy: int = MonitorValues.DEFAULT_UNHEALTHY_THRESHOLD,
+                      healthy: int = MonitorValues.DEFAULT_HEALTHY_THRESHOLD,
+                      heartbeat: bool = False,
+                      ttfbThreshold: int = MonitorValues.DEFAULT_TTFB_THRESHOLD,
+                      flapBackoff: int = MonitorValues.DEFAULT_FLAP_BACKOFF,
+                      tags: list = (),
+                      priority: str = MonitorValues.DEFAULT_PRIORITY):
+        # a single registration attempt, returns the status code
+        self.params = monitorParams(self.appname, self.monitorUrl, emailAddr, timeout, interval, unhealthy, healthy,
+                                    heartbeat, ttfbThreshold, flapBackoff, tags, priority)
+        return await self.register()
+
+    def startMonitoring(self, emailAddr: str = "", checkInterval: float = 30, **monitorArgs):
+        """
+        Register in the background and keep the app registered.
+
+        Parameters:
+            checkInterval (float): seconds between checks that the server still knows about the app
+            monitorArgs: the same as `monitor()`
+
+        Returns:
+            asyncio.Task: the background task, `registered` is set once the app is registered.  The task returns
+                the status code if the server rejects the registration
+        """
+        self.params = monitorParams(self.appname, self.monitorUrl, emailAddr, **monitorArgs)
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.keepRegistered(checkInterval))
+        return self.task
+
+    async def register(self):
+        statusCode = await self.session.post("monitor", self.params)
+        if statusCode in (status.HTTP_201_CREATED, status.HTTP_302_FOUND):
+            self.registered.set()
+        return statusCode
+
+    async def keepRegistered(self, checkInterval: float):
+        retryInterval = MIN_RETRY_INTERVAL
+        while True:
+            if not self.registered.is_set():
+                statusCode = await self.register()
+                if statusCode != status.HTTP_503_SERVICE_UNAVAILABLE and not self.registered.is_set():
+                    # retrying won't change the server's mind
+                    logging.error(f"Registering `{self.appname}` returned {statusCode}, giving up.")
+                    return statusCode
+                if not self.registered.is_set():
+                    logging.warning(f"Registering `{self.appname}` returned {statusCode}, retrying in {retryInterval}s.")
+                    await asyncio.sleep(retryInterval)
+                    retryInterval = min(retryInterval * 2, MAX_RETRY_INTERVAL)
+                    continue
+                logging.info(f"`{self.appname}` registered with the HealthChecker Server.")
+                retryInterval = MIN_RETRY_INTERVAL
+
+            await asyncio.sleep(checkInterval)
+            if await self.info() == status.HTTP_400_BAD_REQUEST:
+                # the server doesn't know about the app anymore, probably restarted
+                logging.warning(f"HealthChecker Server forgot about `{self.appname}`, registering again.")
+                self.registered.clear()
+
+    async def heartbeat(self):
+        return await self.session.get("heartbeat", {"appname": self.appname})
+
+    async def stop(self):
+        self.registered.clear()
+        return await self.session.get("stopmonitoring", {"appname": self.appname})
+
+    async def pause(self):
+        return await self.session.get("pause", {"appname": self.appname})
+
+    async def resume(self):
+        return await self.session.get("resume", {"appname": self.appname})
+
+    async def info(self):
+        return await self.session.get("info", {"appname": self.appname})
+
+    async def close(self, stop: bool = True):
+        # stop the background registration and optionally monitoring
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        if stop and self.registered.is_set():
+            await self.stop()
+        if self.ownsSession:
+            await self.session.close()
+
+
+if __name__ == '__main__':
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from threading import Thread
+    from time import perf_counter, sleep
+    from urllib.parse import urlsplit, parse_qs
+
+    class StubServer(BaseHTTPRequestHandler):
+        # enough of the HealthChecker Server api to register apps, `unavailable` requests fail first
+        protocol_version = 'HTTP/1.1'
+        apps = set()
+        unavailable = 0
+        connections = 0
+        latency = 0.001
+
+        def setup(self):
+            super().setup()
+            StubServer.connections += 1
+
+        def reply(self, statusCode):
+            sleep(StubServer.latency)
+            self.send_response(statusCode)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def do_GET(self):
+            parsed = urlsplit(self.path)
+            appname = parse_qs(parsed.query).get('appname', [''])[0]
+            if parsed.path.endswith('/stopmonitoring') and appname in StubServer.apps:
+                StubServer.apps.discard(appname)
+                return self.reply(status.HTTP_200_OK)
+            self.reply(status.HTTP_200_OK if appname in StubServer.apps else status.HTTP_400_BAD_REQUEST)
+
+        def do_POST(self):
+            form = parse_qs(self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8'))
+            if StubServer.unavailable:
+                StubServer.unavailable -= 1
+                return self.reply(status.HTTP_503_SERVICE_UNAVAILABLE)
+            appname = form['appname'][0]
+            if int(form['interval'][0]) < MonitorValues.MIN_INTERVAL:
+                return self.reply(status.HTTP_406_NOT_ACCEPTABLE)
+            created = appname not in StubServer.apps
+            StubServer.apps.add(appname)
+            self.reply(status.HTTP_201_CREATED if created else status.HTTP_302_FOUND)
+
+        def log_message(self, *args):
+            pass
+
+    class StubHTTPServer(ThreadingHTTPServer):
+        # the default backlog of 5 drops the benchmark's connections and they wait on SYN retransmits
+        request_queue_size = 128
+
+    server = StubHTTPServer(('127.0.0.1', 0), StubServer)
+    Thread(target=server.serve_forever, daemon=True).start()
+    addr = server.server_address
+    apps = 100
+
+    async def selfTest():
+        session = HealthCheckerSession(addr)
+        client = AsyncHealthCheckerServer('app', 'http://127.0.0.1:9090', session)
+        assert await client.monitor() == status.HTTP_201_CREATED                     # nosec
+        assert await client.monitor() == status.HTTP_302_FOUND                       # nosec
+        assert await client.info() == status.HTTP_200_OK                             # nosec
+        await client.close()
+        assert 'app' not in StubServer.apps and await client.info() == 400          # nosec
+
+        # unreachable servers don't raise
+        missing = HealthCheckerSession(('127.0.0.1', 9), timeout=1)
+        assert await AsyncHealthCheckerServer('app', '', missing).info() == 503      # nosec
+
+        # registration is retried in the background and redone after the server restarts
+        StubServer.unavailable = 2
+        client = AsyncHealthCheckerServer('retry', 'http://127.0.0.1:9090', session)
+        client.startMonitoring(checkInterval=0.1)
+        await asyncio.wait_for(client.registered.wait(), 10)
+        StubServer.apps.clear()
+        await asyncio.sleep(0.3)
+        assert 'retry' in StubServer.apps                                            # nosec
+        await client.close()
+
+        # a rejected registration isn't retried
+        client = AsyncHealthCheckerServer('rejected', 'http://127.0.0.1:9090', session)
+        task = client.startMonitoring(interval=1)
+        assert await asyncio.wait_for(task, 1) == status.HTTP_406_NOT_ACCEPTABLE     # nosec
+        assert not client.registered.is_set() and 'rejected' not in StubServer.apps  # nosec
+        await client.close()
+
+        # a pooled connection is closed when the request times out on it
+        slow = HealthCheckerSession(addr, timeout=0.1)
+        assert await slow.get('info', {'appname': 'retry'}) == status.HTTP_400_BAD_REQUEST  # nosec
+        _, pooled = slow.idle[-1]
+        StubServer.latency = 0.3
+        assert await slow.get('info', {'appname': 'retry'}) == 503                   # nosec
+        assert pooled.is_closing() and not slow.idle                                 # nosec
+        StubServer.latency = 0.001
+        await session.close()
+
+    asyncio.run(selfTest())
+
+    # a client built outside of the event loop it's used in
+    outside = AsyncHealthCheckerServer('outside', 'http://127.0.0.1:9090', HealthCheckerSession(addr))
+
+    async def registerOutside():
+        outside.startMonitoring()
+        await asyncio.wait_for(outside.registered.wait(), 5)
+        await outside.close()
+
+    asyncio.run(registerOutside())
+
+    # benchmark: registering 100 apps at boot
+    def syncBoot():
+        clients = []
+        for i in range(apps):
+            client = HealthCheckerServer.__new__(HealthCheckerServer)
+            client.appname, client.monitorUrl = f'sync{i}', 'http://127.0.0.1:9090'
+            client.healthCheckerUrl = f'http://{addr[0]}:{addr[1]}/healthchecker/'
+            assert client.post('monitor', monitorParams(client.appname, client.monitorUrl)) == 201  # nosec
+            clients.append(client)
+        return clients
+
+    async def asyncBoot():
+        session = HealthCheckerSession(addr)
+        clients = [AsyncHealthCheckerServer(f'async{i}', 'http://127.0.0.1:9090', session) for i in range(apps)]
+        start = perf_counter()
+        for client in clients:
+            client.startMonitoring()
+        startup = perf_counter() - start
+        await asyncio.gather(*(client.registered.wait() for client in clients))
+        registered = perf_counter() - start
+        for client in clients:
+            await client.close(stop=False)
+        await session.close()
+        return startup, registered
+
+    StubServer.connections = 0
+    start = perf_counter()
+    syncBoot()
+    syncTime, syncConnections = perf_counter() - start, StubServer.connections
+    StubServer.connections = 0
+    startup, registered = asyncio.run(asyncBoot())
+    print(f'{apps} apps with 1ms server latency: sync {syncTime * 1000:.0f}ms ({syncConnections} connections), '
+          f'async startup blocked {startup * 1000:.2f}ms, all registered in {registered * 1000:.0f}ms '
+          f'({StubServer.connections} connections)')
+    server.shutdown()
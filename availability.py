@@ -0,0 +1,205 @@
+from time import time
+
+
+class SlidingWindow:
+    """
+    Fixed width ring of time buckets with running totals.
+
+    Adding to the window and reading the totals are O(1); expired buckets are
+    subtracted from the totals as the window slides forward so nothing is ever rescanned.
+    """
+    __slots__ = ('span', 'width', 'buckets', 'head', 'upSeconds', 'downSeconds', 'outages')
+
+    BUCKETS = 60
+
+    def __init__(self, span: float):
+        self.span = span
+        self.width = span / SlidingWindow.BUCKETS
+        # each bucket is [upSeconds, downSeconds, outages]
+        self.buckets = [[0.0, 0.0, 0] for _ in range(SlidingWindow.BUCKETS)]
+        self.head = None
+        self.upSeconds = self.downSeconds = 0.0
+        self.outages = 0
+
+    def advance(self, now: float):
+        idx = int(now // self.width)
+        if self.head is None:
+            self.head = idx
+            return
+        # never clear more than the whole ring, no matter how long it has been idle
+        steps = min(idx - self.head, SlidingWindow.BUCKETS)
+        for step in range(1, steps + 1):
+            bucket = self.buckets[(self.head + step) % SlidingWindow.BUCKETS]
+            self.upSeconds -= bucket[0]
+            self.downSeconds -= bucket[1]
+            self.outages -= bucket[2]
+            bucket[0] = bucket[1] = 0.0
+            bucket[2] = 0
+        if idx > self.head:
+            self.head = idx
+
+    def add(self, now: float, upSeconds: float = 0.0, downSeconds: float = 0.0, outages: int = 0):
+        self.advance(now)
+        bucket = self.buckets[self.head % SlidingWindow.BUCKETS]
+        bucket[0] += upSeconds
+        bucket[1] += downSeconds
+        bucket[2] += outages
+        self.upSeconds += upSeconds
+        self.downSeconds += downSeconds
+        self.outages += outages
+
+    def uptime(self):
+        total = self.upSeconds + self.downSeconds
+        return round(100.0 * self.upSeconds / total, 3) if total > 0 else None
+
+
+class Availability:
+    """
+    Incremental availability/SLA counters for a single monitored app.
+
+    Each health check result is fed to `update()` which attributes the time since the
+    previous check to the previous result (up or down) in every sliding window.
+    An outage starts when the app goes UNHEALTHY and ends when it is HEALTHY again,
+    which is what MTTR and MTBF are computed from.
+    """
+
+    WINDOWS = (
+        ('1h', 60 * 60),
+        ('24h', 60 * 60 * 24),
+        ('7d', 60 * 60 * 24 * 7),
+        ('30d', 60 * 60 * 24 * 30),
+    )
+
+    def __init__(self):
+        self.windows = {name: SlidingWindow(span) for name, span in Availability.WINDOWS}
+        self.lastUpdate = None
+        self.lastUp = None
+
+        # lifetime counters for MTTR/MTBF
+        self.outageStart = None
+        self.outages = 0
+        self.recoveries = 0
+        self.totalUpSeconds = 0.0
+        self.totalOutageSeconds = 0.0
+
+    def update(self, up: bool, unhealthy: bool = False, now: float = None):
+        """
+        Record a health check.
+
+        Args:
+            up (bool): the health check passed
+            unhealthy (bool): the state machine is in the UNHEALTHY state after this check
+            now (float): epoch seconds of the check, defaults to now
+        """
+        now = time() if now is None else now
+
+        upSeconds = downSeconds = 0.0
+        if self.lastUpdate is not None and now > self.lastUpdate:
+            if self.lastUp:
+                upSeconds = now - self.lastUpdate
+            else:
+                downSeconds = now - self.lastUpdate
+        self.totalUpSeconds += upSeconds
+
+        outages = 0
+        if unhealthy and self.outageStart is None:
+            # app just went UNHEALTHY
+            self.outageStart = now
+            self.outages += 1
+            outages = 1
+        elif not unhealthy and up and self.outageStart is not None:
+            # app recovered from an outage
+            self.totalOutageSeconds += now - self.outageStart
+            self.recoveries += 1
+            self.outageStart = None
+
+        for window in self.windows.values():
+            window.add(now, upSeconds, downSeconds, outages)
+
+        self.lastUpdate = now
+        self.lastUp = up
+
+    def pause(self):
+        # the time until the next check isn't counted as up or down (i.e. a maintenance window)
+        self.lastUpdate = None
+
+    def mttr(self):
+        # mean time to recovery in seconds
+        return round(self.totalOutageSeconds / self.recoveries, 3) if self.recoveries else None
+
+    def mtbf(self):
+        # mean time between failures in seconds
+        return round(self.totalUpSeconds / self.outages, 3) if self.outages else None
+
+    def report(self, now: float = None):
+        now = time() if now is None else now
+        report = {}
+        for name, window in self.windows.items():
+            window.advance(now)
+            report[name] = {'uptime': window.uptime(), 'outages': window.outages}
+        report['mttr'] = self.mttr()
+        report['mtbf'] = self.mtbf()
+        report['outages'] = self.outages
+        report['inOutage'] = self.outageStart is not None
+        return report
+
+    def __repr__(self):
+        return str(self.report())
+
+
+if __name__ == '__main__':
+    avail = Availability()
+    t = 1_000_000.0
+
+    # no data, no uptime
+    assert avail.report(now=t)['1h']['uptime'] is None                  # nosec
+
+    # 10 minutes of passing checks every 30 seconds
+    for _ in range(20):
+        avail.update(True, now=t)
+        t += 30
+    assert avail.report(now=t)['1h']['uptime'] == 100.0                 # nosec
+
+    # 5 minute outage
+    avail.update(False, now=t)
+    t += 30
+    avail.update(False, unhealthy=True, now=t)
+    for _ in range(9):
+        t += 30
+        avail.update(False, unhealthy=True, now=t)
+    t += 30
+    avail.update(True, now=t)
+    report = avail.report(now=t)
+    assert report['outages'] == 1 and not report['inOutage']            # nosec
+    assert report['1h']['outages'] == 1                                 # nosec
+    assert report['mttr'] == 300.0                                      # nosec
+    assert 60.0 < report['1h']['uptime'] < 70.0                         # nosec
+
+    # after an hour and a bit the outage slides out of the 1h window only
+    t += 60 * 61
+    avail.update(True, now=t)
+    report = avail.report(now=t)
+    assert report['1h']['uptime'] == 100.0                              # nosec
+    assert report['1h']['outages'] == 0                                 # nosec
+    assert report['24h']['outages'] == 1                                # nosec
+    uptime = report['24h']['uptime']
+
+    # a maintenance window in between isn't counted
+    avail.pause()
+    t += 60 * 60 * 2
+    avail.update(False, now=t)
+    report = avail.report(now=t)
+    assert report['1h']['uptime'] is None and report['24h']['uptime'] == uptime    # nosec
+
+    # updates are O(1): 10k apps x 10 checks should be cheap
+    from time import perf_counter
+    apps = [Availability() for _ in range(10_000)]
+    start = perf_counter()
+    for i in range(10):
+        for a in apps:
+            a.update(i % 7 != 0, now=t + i * 30)
+    elapsed = perf_counter() - start
+    start = perf_counter()
+    for a in apps:
+        a.report(now=t + 3000)
+    print(f'100k updates in {elapsed:.2f}s, 10k reports in {perf_counter() - start:.2f}s')
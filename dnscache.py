@@ -0,0 +1,244 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from ipaddress import ip_address
+from socket import getaddrinfo, gaierror, SOCK_STREAM, AF_INET, AF_INET6
+from time import monotonic
+try:
+    import dns.resolver  # https://github.com/rthalley/dnspython
+except ImportError:
+    # without dnspython the record TTLs aren't known and `DnsCache.ttl` is used for every entry
+    dns = None
+
+
+def systemResolver(host: str):
+    """
+    Resolve host with the system resolver.
+
+    Returns:
+        tuple: (list of (family, socktype, proto, ip), ttl) ttl is None when it isn't known
+    """
+    if dns is not None:
+        try:
+            addresses, ttl = [], None
+            for rdtype, family in (('A', AF_INET), ('AAAA', AF_INET6)):
+                try:
+                    answer = dns.resolver.resolve(host, rdtype)
+                except dns.resolver.NoAnswer:
+                    continue
+                addresses += [(family, SOCK_STREAM, 6, rdata.address) for rdata in answer]
+                ttl = answer.rrset.ttl if ttl is None else min(ttl, answer.rrset.ttl)
+            if addresses:
+                return addresses, ttl
+        except dns.exception.DNSException:
+            # might still be in /etc/hosts
+            pass
+    infos = getaddrinfo(host, None, type=SOCK_STREAM)
+    return [(family, socktype, proto, sockaddr[0]) for family, socktype, proto, _, sockaddr in infos], None
+
+
+class CacheEntry:
+    __slots__ = ('addresses', 'error', 'expires', 'refreshAt', 'staleUntil', 'refreshing')
+
+    def __init__(self, addresses, error, expires, refreshAt, staleUntil=None):
+        self.addresses = addresses
+        self.error = error
+        self.expires = expires
+        self.refreshAt = refreshAt
+        # the addresses are served while the resolver is failing until then, however often it is retried
+        self.staleUntil = expires if staleUntil is None else staleUntil
+        self.refreshing = False
+
+
+class DnsCache:
+    """
+    In-process DNS cache for health check targets.
+
+    - entries live for the record TTL (or `ttl` when it isn't known)
+    - failed lookups are cached for `negativeTtl` seconds
+    - entries used after `refreshAhead` of their TTL are refreshed in the background before they expire
+    - if the resolver fails an expired entry is still served for up to `staleTtl` seconds
+    """
+
+    def __init__(self, ttl: float = 60, negativeTtl: float = 5, staleTtl: float = 300, refreshAhead: float = 0.8,
+                 minTtl: float = 5, resolver=systemResolver):
+        self.ttl = ttl
+        self.negativeTtl = negativeTtl
+        self.staleTtl = staleTtl
+        self.refreshAhead = refreshAhead
+        self.minTtl = minTtl
+        self.resolver = resolver
+        self.entries = {}
+        self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='dns-refresh')
+        self.hits = self.misses = self.stale = self.negative = self.refreshes = 0
+
+    def resolve(self, host: str, port: int):
+        # (family, socktype, proto, sockaddr) of each address for host, in the order to try them
+        return self.sockaddrs(self.addresses(host), port)
+
+    async def asyncResolve(self, host: str, port: int):
+        addresses = self.cached(host)
+        if addresses is None:
+            addresses = await asyncio.get_running_loop().run_in_executor(None, self.addresses, host)
+        return self.sockaddrs(addresses, port)
+
+    def addresses(self, host: str):
+        addresses = self.cached(host)
+        if addresses is None:
+            addresses = self.lookup(host)
+        return addresses
+
+    def cached(self, host: str, now: float = None):
+        # the cached addresses for host, None if there is a cache miss
+        entry = self.entries.get(host)
+        if entry is None:
+            try:
+                # ip addresses don't need resolving
+                address = ip_address(host)
+                return [(AF_INET6 if address.version == 6 else AF_INET, SOCK_STREAM, 6, host)]
+            except ValueError:
+                return None
+
+        now = monotonic() if now is None else now
+        if now >= entry.expires:
+            return None
+        if entry.error is not None:
+            self.negative += 1
+            raise entry.error
+        self.hits += 1
+        if now >= entry.refreshAt and not entry.refreshing:
+            entry.refreshing = True
+            self.refreshes += 1
+            self.executor.submit(self.lookup, host)
+        return entry.addresses
+
+    def lookup(self, host: str, now: float = None):
+        now = monotonic() if now is None else now
+        try:
+            addresses, ttl = self.resolver(host)
+        except (OSError, gaierror) as e:
+            entry = self.entries.get(host)
+            if entry is not None and entry.error is None and now < entry.staleUntil:
+                # stale while revalidate, try the resolver again in a little while
+                logging.warning(f'DNS lookup for `{host}` failed, using stale addresses: {e}')
+                self.stale += 1
+                entry.expires = entry.refreshAt = min(now + self.negativeTtl, entry.staleUntil)
+                entry.refreshing = False
+                return entry.addresses
+            self.entries[host] = CacheEntry(None, e, now + self.negativeTtl, now + self.negativeTtl)
+            raise
+        finally:
+            self.misses += 1
+
+        ttl = max(self.minTtl, self.ttl if ttl is None else ttl)
+        self.entries[host] = CacheEntry(addresses, None, now + ttl, now + ttl * self.refreshAhead,
+                                        now + ttl + self.staleTtl)
+        return addresses
+
+    @staticmethod
+    def sockaddrs(addresses, port: int):
+        return [
+            (family, socktype, proto, (ip, port) if family == AF_INET else (ip, port, 0, 0))
+            for family, socktype, proto, ip in addresses
+        ]
+
+    def stats(self):
+        return {
+            'entries': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'negative': self.negative,
+            'stale': self.stale,
+            'refreshes': self.refreshes,
+        }
+
+
+if __name__ == '__main__':
+    from time import perf_counter, sleep
+
+    class StubResolver:
+        # local resolver with injected latency and failures
+        def __init__(self, latency):
+            self.latency = latency
+            self.failing = False
+            self.lookups = 0
+
+        def __call__(self, host):
+            self.lookups += 1
+            sleep(self.latency)
+            if self.failing or host.startswith('nx'):
+                raise gaierror(f'stub resolver failed for {host}')
+            return [(AF_INET, SOCK_STREAM, 6, '127.0.0.1')], 30
+
+    stub = StubResolver(latency=0.05)
+    cache = DnsCache(resolver=stub)
+
+    # ip addresses are never looked up
+    assert cache.resolve('127.0.0.1', 80) == [(AF_INET, SOCK_STREAM, 6, ('127.0.0.1', 80))]  # nosec
+    assert cache.resolve('::1', 80)[0][3] == ('::1', 80, 0, 0)                               # nosec
+    assert stub.lookups == 0                                                                 # nosec
+
+    # positive and negative caching
+    assert cache.resolve('app.local', 8080)[0][3] == ('127.0.0.1', 8080)                     # nosec
+    assert cache.resolve('app.local', 9090)[0][3] == ('127.0.0.1', 9090)                     # nosec
+    assert stub.lookups == 1                                                                 # nosec
+    for _ in range(2):
+        try:
+            cache.resolve('nx.local', 80)
+            assert False                                                                     # nosec
+        except gaierror:
+            pass
+    assert stub.lookups == 2 and cache.negative == 1                                         # nosec
+
+    # refresh ahead happens in the background
+    now = monotonic()
+    assert cache.cached('app.local', now=now + 25) is not None                               # nosec
+    cache.executor.shutdown(wait=True)
+    cache.executor = ThreadPoolExecutor(max_workers=2)
+    assert stub.lookups == 3                                                                 # nosec
+
+    # stale while revalidate
+    stub.failing = True
+    assert cache.lookup('app.local', now=monotonic() + 60)[0][3] == '127.0.0.1'              # nosec
+    assert cache.stale == 1                                                                  # nosec
+    try:
+        cache.lookup('app.local', now=monotonic() + 1000)
+        assert False                                                                         # nosec
+    except gaierror:
+        pass
+
+    # retrying a failing resolver doesn't keep stale addresses around past `staleTtl` after they expired
+    stub.latency = 0
+    stub.failing = False
+    start = monotonic()
+    cache.lookup('app.local', now=start)
+    stub.failing = True
+    served = []
+    for t in range(30, 5000, 5):
+        try:
+            if cache.cached('app.local', now=start + t) is None:
+                cache.lookup('app.local', now=start + t)
+            served.append(t)
+        except gaierror:
+            pass
+    assert served and max(served) < 30 + cache.staleTtl, max(served)                        # nosec
+    stub.failing = False
+    stub.latency = 0.05
+
+    # benchmark: 10 hosts shared by 1000 probes with a 50ms resolver
+    hosts = [f'host{i}.local' for i in range(10)]
+    start = perf_counter()
+    for host in hosts:
+        stub(host)
+    uncachedTime = (perf_counter() - start) / len(hosts)
+    cache = DnsCache(resolver=stub)
+    start = perf_counter()
+    for i in range(1000):
+        cache.resolve(hosts[i % 10], 80)
+    cachedTime = perf_counter() - start
+    start = perf_counter()
+    for i in range(100_000):
+        cache.resolve(hosts[i % 10], 80)
+    hitTime = (perf_counter() - start) / 100_000
+    print(f'1000 resolves: uncached {uncachedTime * 1000:.1f}s, cached {cachedTime:.2f}s; '
+          f'cache hit {hitTime * 1e6:.2f}us, {cache.stats()}')
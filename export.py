@@ -0,0 +1,239 @@
+import json
+from datetime import datetime
+from http import HTTPStatus
+try:
+    import pyarrow  # https://arrow.apache.org/docs/python/
+except ImportError:
+    # only needed to export in the Arrow IPC format
+    pyarrow = None
+
+# lines are batched into chunks of about this size before being sent
+CHUNK_SIZE = 64 * 1024
+ARROW_BATCH_ROWS = 10000
+TIMING_PHASES = ('dns', 'connect', 'tls', 'ttfb', 'body', 'total')
+
+
+class StreamingBody:
+    # response body that is sent as it is generated with chunked transfer encoding
+    def __init__(self, chunks, contentType: str):
+        self.chunks = chunks
+        self.contentType = contentType
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+
+def exportRecords(appsMonitored: dict):
+    """
+    Generate a record for every monitored app followed by one for each of its health checks.
+
+    The records use the same field names as `/healthchecker/monitor` so they can be imported again.
+    """
+    # only the names are copied so apps can come and go while exporting
+    for appname in list(appsMonitored):
+        appData = appsMonitored.get(appname)
+        if appData is None:
+            continue
+        yield monitorRecord(appname, appData)
+        for checkTime, statusCode, timings in list(appData.healthchecks):
+            yield checkRecord(appname, checkTime, statusCode, timings)
+
+
+def monitorRecord(appname: str, appData):
+    # also shipped to warm standbys when an app is registered
+    return {
+        'type': 'monitor',
+        'appname': appname,
+        'url': appData.url,
+        'email': appData.emailAddr,
+        'timeout': appData.timeout,
+        'interval': appData.interval,
+        'unhealthy_threshold': appData.healthState.unhealthyThreshold,
+        'healthy_threshold': appData.healthState.healthyThreshold,
+        'heartbeat': 'true' if appData.heartbeat else 'false',
+        'ttfb_threshold': appData.ttfbThreshold,
+        'flap_backoff': appData.flapBackoff,
+        'tags': ','.join(appData.tags),
+        'priority': appData.priority,
+        'state': appData.healthState.state.name,
+    }
+
+
+def checkRecord(appname: str, checkTime: datetime, statusCode: int, timings):
+    return {
+        'type': 'check',
+        'appname': appname,
+        'time': checkTime.isoformat(),
+        'statusCode': statusCode,
+        'timings': vars(timings) if timings is not None else None,
+    }
+
+
+def ndjsonChunks(records):
+    # newline delimited json, batched into chunks of about `CHUNK_SIZE`
+    encode = json.JSONEncoder(separators=(',', ':')).encode
+    lines, size = [], 0
+    for record in records:
+        line = encode(record) + '\n'
+        lines.append(line)
+        size += len(line)
+        if size >= CHUNK_SIZE:
+            yield ''.join(lines).encode('utf-8')
+            lines, size = [], 0
+    if lines:
+        yield ''.join(lines).encode('utf-8')
+
+
+class ChunkSink:
+    # file like object for pyarrow that hands back what was written since the last drain
+    def __init__(self):
+        self.chunks = []
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data, self.chunks = b''.join(self.chunks), []
+        return data
+
+
+def arrowChunks(records):
+    # Arrow IPC stream of the health checks (monitors are only in the ndjson export)
+    schema = pyarrow.schema(
+        [('appname', pyarrow.string()), ('time', pyarrow.timestamp('us')), ('statusCode', pyarrow.int32())]
+        + [(phase, pyarrow.float64()) for phase in TIMING_PHASES]
+    )
+    sink = ChunkSink()
+    writer = pyarrow.ipc.new_stream(pyarrow.PythonFile(sink, mode='w'), schema)
+    columns = {name: [] for name in schema.names}
+    for record in records:
+        if record['type'] != 'check':
+            continue
+        columns['appname'].append(record['appname'])
+        columns['time'].append(datetime.fromisoformat(record['time']))
+        columns['statusCode'].append(record['statusCode'])
+        timings = record['timings'] or {}
+        for phase in TIMING_PHASES:
+            columns[phase].append(timings.get(phase))
+        if len(columns['appname']) >= ARROW_BATCH_ROWS:
+            writer.write_batch(pyarrow.record_batch(list(columns.values()), schema=schema))
+            columns = {name: [] for name in schema.names}
+            yield sink.drain()
+    if columns['appname']:
+        writer.write_batch(pyarrow.record_batch(list(columns.values()), schema=schema))
+    writer.close()
+    yield sink.drain()
+
+
+class Importer:
+    """
+    Consumes an ndjson export one line at a time.
+
+    `addMonitor(record)` and `addCheck(record)` return True if the record was imported, the
+    checks that follow a monitor that wasn't imported are skipped as well.
+    Chunks that don't end on line boundaries are fed with `feedChunk()` followed by `close()`.
+    """
+
+    def __init__(self, addMonitor, addCheck):
+        self.addMonitor = addMonitor
+        self.addCheck = addCheck
+        self.counts = {'monitors': 0, 'checks': 0, 'skipped': 0, 'errors': 0}
+        self.pending = b''
+        self.skippedApp = None
+
+    def feed(self, line: bytes):
+        line = line.strip()
+        if not line:
+            return
+        try:
+            record = json.loads(line)
+            if record.get('type') == 'monitor':
+                imported, kind = self.addMonitor(record), 'monitors'
+                self.skippedApp = None if imported else record['appname']
+            elif record.get('type') == 'check':
+                imported = record['appname'] != self.skippedApp and self.addCheck(record)
+                kind = 'checks'
+            else:
+                imported, kind = False, None
+        except (ValueError, KeyError, TypeError):
+            self.counts['errors'] += 1
+            return
+        self.counts[kind if imported else 'skipped'] += 1
+
+    def feedChunk(self, chunk: bytes):
+        lines = (self.pending + chunk).split(b'\n')
+        self.pending = lines.pop()
+        for line in lines:
+            self.feed(line)
+
+    def close(self):
+        # returns (body, statusCode) like the other api calls
+        self.feed(self.pending)
+        self.pending = b''
+        return self.counts, HTTPStatus.OK
+
+    def feedChunks(self, chunks):
+        for chunk in chunks:
+            self.feedChunk(chunk)
+        return self.close()
+
+    def result(self):
+        return self.counts
+
+
+if __name__ == '__main__':
+    import tracemalloc
+    from time import perf_counter
+    from types import SimpleNamespace
+    from probe import ProbeTimings
+
+    def makeApp(checks, now=datetime(2020, 1, 1), timings=ProbeTimings(1, 2, 3, 4, 5, 15)):
+        return SimpleNamespace(
+            url='http://127.0.0.1:8080', emailAddr='me@example.com', timeout=5, interval=30, heartbeat=False,
+            ttfbThreshold=0, flapBackoff=1, tags=['gateway'], priority='normal',
+            healthState=SimpleNamespace(unhealthyThreshold=2, healthyThreshold=10, state=SimpleNamespace(name='HEALTHY')),
+            healthchecks=[(now, 200, timings)] * (checks - 1) + [(now, 500, None)],
+        )
+
+    # round trip
+    apps = {'one': makeApp(2), 'two': makeApp(1)}
+    records = list(exportRecords(apps))
+    assert [record['type'] for record in records] == ['monitor', 'check', 'check', 'monitor', 'check']    # nosec
+    assert records[1]['timings']['ttfb'] == 4 and records[2]['timings'] is None                        # nosec
+
+    imported = {'monitor': [], 'check': []}
+    importer = Importer(lambda r: imported['monitor'].append(r) or True, lambda r: r['statusCode'] == 200)
+    chunks = [chunk[i:i + 7] for chunk in ndjsonChunks(records) for i in range(0, len(chunk), 7)]
+    importer.feedChunks(chunks + [b'garbage\n'])
+    assert importer.result() == {'monitors': 2, 'checks': 1, 'skipped': 2, 'errors': 1}               # nosec
+    assert imported['monitor'][0]['url'] == 'http://127.0.0.1:8080'                                   # nosec
+
+    # benchmark: 10k monitors with 100 checks each is 1M history rows
+    apps = {f'app{i}': makeApp(100) for i in range(10_000)}
+    start = perf_counter()
+    size = sum(len(chunk) for chunk in ndjsonChunks(exportRecords(apps)))
+    elapsed = perf_counter() - start
+    tracemalloc.start()
+    largestChunk = max(len(chunk) for chunk in ndjsonChunks(exportRecords(apps)))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f'ndjson export: {size / 1e6:.0f}MB in {elapsed:.1f}s, '
+          f'peak memory {peak / 1024:.0f}KB, largest chunk {largestChunk / 1024:.0f}KB')
+
+    start = perf_counter()
+    importer = Importer(lambda r: True, lambda r: True)
+    importer.feedChunks(ndjsonChunks(exportRecords(apps)))
+    print(f'ndjson import: {importer.result()} in {perf_counter() - start:.1f}s')
+
+    if pyarrow is not None:
+        start = perf_counter()
+        size = sum(len(chunk) for chunk in arrowChunks(exportRecords(apps)))
+        print(f'arrow export: {size / 1e6:.0f}MB in {perf_counter() - start:.1f}s')
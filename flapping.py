@@ -0,0 +1,140 @@
+class FlapDetector:
+    """
+    Flap detection for a single monitored app, like Nagios does it.
+
+    The result of each health check (ok, slow or failed) is compared with the previous one and
+    the last `WINDOW` comparisons are kept in a ring.  The percent state change weights the
+    newest change `NEWEST_WEIGHT` and the oldest `OLDEST_WEIGHT` so recent flapping counts more.
+    An app starts flapping when the percent state change goes over `HIGH_THRESHOLD` and stops
+    once it drops under `LOW_THRESHOLD`.
+
+    The weighted sum is kept up to date as the ring slides, every weight drops by the same step
+    when a new result is added, so each check is O(1).
+    """
+    __slots__ = ('ring', 'head', 'changes', 'weighted', 'lastResult', 'flapping')
+
+    WINDOW = 21
+    OLDEST_WEIGHT = 0.8
+    NEWEST_WEIGHT = 1.2
+    STEP = (NEWEST_WEIGHT - OLDEST_WEIGHT) / (WINDOW - 1)
+    # the weight of a full window of changes
+    TOTAL_WEIGHT = (OLDEST_WEIGHT + NEWEST_WEIGHT) / 2 * WINDOW
+
+    LOW_THRESHOLD = 5.0
+    HIGH_THRESHOLD = 20.0
+
+    def __init__(self):
+        self.ring = [0] * FlapDetector.WINDOW
+        self.head = 0
+        # number of changes in the ring and their weighted sum
+        self.changes = 0
+        self.weighted = 0.0
+        self.lastResult = None
+        self.flapping = False
+
+    def update(self, result):
+        """
+        Record the result of a health check.
+
+        Returns:
+            bool: True if the app started or stopped flapping with this result
+        """
+        changed = int(self.lastResult is not None and result != self.lastResult)
+        self.lastResult = result
+
+        # the oldest change falls out of the window and the rest get one step older
+        oldest = self.ring[self.head]
+        self.changes -= oldest
+        self.weighted -= oldest * FlapDetector.OLDEST_WEIGHT + self.changes * FlapDetector.STEP
+        self.ring[self.head] = changed
+        self.head = (self.head + 1) % FlapDetector.WINDOW
+        self.changes += changed
+        self.weighted += changed * FlapDetector.NEWEST_WEIGHT
+
+        percent = self.percentStateChange()
+        if not self.flapping and percent > FlapDetector.HIGH_THRESHOLD:
+            self.flapping = True
+            return True
+        if self.flapping and percent < FlapDetector.LOW_THRESHOLD:
+            self.flapping = False
+            return True
+        return False
+
+    def percentStateChange(self):
+        # rounded so the float error of the running sum can't keep an app flapping
+        return round(100.0 * self.weighted / FlapDetector.TOTAL_WEIGHT, 6)
+
+    def report(self):
+        return {'flapping': self.flapping, 'percentStateChange': round(self.percentStateChange(), 2)}
+
+    def snapshot(self):
+        # the window oldest change first, enough to carry on detecting somewhere else (i.e. a warm standby)
+        return {
+            'ring': self.ring[self.head:] + self.ring[:self.head],
+            'weighted': self.weighted,
+            'lastResult': self.lastResult,
+            'flapping': self.flapping,
+        }
+
+    def restore(self, snapshot: dict):
+        self.ring = list(snapshot['ring'])
+        self.head = 0
+        self.changes = sum(self.ring)
+        self.weighted = snapshot['weighted']
+        self.lastResult = snapshot['lastResult']
+        self.flapping = snapshot['flapping']
+
+
+if __name__ == '__main__':
+    from random import Random
+    from time import perf_counter
+
+    def bruteForce(results):
+        # the percent state change computed from scratch over the last window of results
+        changes = [int(a != b) for a, b in zip(results, results[1:])]
+        changes = ([0] * FlapDetector.WINDOW + changes)[-FlapDetector.WINDOW:]
+        weighted = sum(change * (FlapDetector.OLDEST_WEIGHT + i * FlapDetector.STEP) for i, change in enumerate(changes))
+        return 100.0 * weighted / FlapDetector.TOTAL_WEIGHT
+
+    # the running sum matches the sum over the window
+    rand = Random(42)
+    detector, results = FlapDetector(), []
+    for _ in range(1000):
+        results.append(rand.choice(('ok', 'ok', 'ok', 'slow', 'failed')))
+        detector.update(results[-1])
+        assert abs(detector.percentStateChange() - bruteForce(results)) < 1e-6      # nosec
+
+    # a steady app never flaps, a single failure doesn't either
+    detector = FlapDetector()
+    for result in ['ok'] * 30 + ['failed'] + ['ok'] * 30:
+        assert not detector.update(result) and not detector.flapping               # nosec
+
+    # synthetic target bouncing around the ttfb threshold every few checks
+    detector, transitions = FlapDetector(), []
+    for check in range(200):
+        bouncing = 40 <= check < 120
+        result = ('slow' if check % 3 == 0 else 'ok') if bouncing else 'ok'
+        if detector.update(result):
+            transitions.append((check, detector.flapping))
+    print(f'flapping transitions (check, flapping): {transitions}')
+    assert len(transitions) == 2                                                    # nosec
+    assert transitions[0][1] and 40 < transitions[0][0] < 60                        # nosec
+    assert not transitions[1][1] and 120 < transitions[1][0] < 150                  # nosec
+
+    # a restored detector carries on where the snapshot was taken
+    detector, restored = FlapDetector(), FlapDetector()
+    for check in range(30):
+        detector.update('failed' if check % 2 else 'ok')
+    restored.restore(detector.snapshot())
+    assert restored.flapping                                                        # nosec
+    for _ in range(40):
+        assert detector.update('failed') == restored.update('failed')               # nosec
+        assert detector.percentStateChange() == restored.percentStateChange()       # nosec
+    assert not restored.flapping                                                    # nosec
+
+    # the per check cost doesn't depend on the window
+    detector = FlapDetector()
+    start = perf_counter()
+    for check in range(1_000_000):
+        detector.update(check % 3 == 0)
+    print(f'update: {(perf_counter() - start):.2f}us per check')
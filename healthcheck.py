@@ -1,8 +1,11 @@
 from dataclasses import dataclass
+from datetime import datetime
 from enum import Enum
 from flask import jsonify, make_response
 from flask_api import status
+from socket import socket, AF_INET, SOCK_DGRAM
 from zeroconf import Zeroconf
+from heartbeat import HEARTBEAT_DATAGRAM_PREFIX
 from sys import exit, version_info
 from iputils import requestsRetrySession
 if not version_info > (3, 6):
@@ -33,9 +36,20 @@ class MonitorValues:
 
     #   Healthy Threshold: 10 time (2-10)
     DEFAULT_HEALTHY_THRESHOLD: int = 10
-    MIN_HEALTHY_THRESHOLD: int = 10
+    MIN_HEALTHY_THRESHOLD: int = 2
     MAX_HEALTHY_THRESHOLD: int = 10
 
+    #   TTFB Threshold: 0 ms disabled (0-60000ms)
+    DEFAULT_TTFB_THRESHOLD: int = 0
+    MAX_TTFB_THRESHOLD: int = 60000
+
+    #   Flap Backoff: interval multiplier while flapping, 1 disabled (1-10)
+    DEFAULT_FLAP_BACKOFF: int = 1
+    MAX_FLAP_BACKOFF: int = 10
+
+    #   Priority: critical, normal or low, the order health checks run in when they're overloaded
+    DEFAULT_PRIORITY: str = 'normal'
+
 class HealthStatus(Enum):
     # For “pass” status, HTTP response code in the 2xx-3xx range MUST be used.
     PASS = "pass"  # nosec
@@ -160,26 +174,76 @@ class HealthCheckResponse:
         return res
 
 
+def monitorParams(appname: str, monitorUrl: str,
+                  emailAddr: str = "",
+                  timeout: int = MonitorValues.DEFAULT_TIME_OUT,
+                  interval: int = MonitorValues.DEFAULT_INTERVAL,
+                  unhealthy: int = MonitorValues.DEFAULT_UNHEALTHY_THRESHOLD,
+                  healthy: int = MonitorValues.DEFAULT_HEALTHY_THRESHOLD,
+                  heartbeat: bool = False,
+                  ttfbThreshold: int = MonitorValues.DEFAULT_TTFB_THRESHOLD,
+                  flapBackoff: int = MonitorValues.DEFAULT_FLAP_BACKOFF,
+                  tags: list = (),
+                  priority: str = MonitorValues.DEFAULT_PRIORITY):
+    # form sent to `/healthchecker/monitor`
+    return {
+        "appname": appname,
+        "url": monitorUrl,
+        #   email addr to send email when unhealthy
+        "email": emailAddr,
+        #   Response Timeout: 5 sec (2-60sec)
+        "timeout": timeout,
+        #   HealthCheck Interval: 30 sec (5-300sec)
+        "interval": interval,
+        #   Unhealthy Threshold: 2 times (2-10)
+        "unhealthy_threshold": unhealthy,
+        #   Healthy Threshold: 10 time (2-10)
+        "healthy_threshold": healthy,
+        #   Heartbeat: app calls `heartbeat()` every interval instead of being polled
+        "heartbeat": "true" if heartbeat else "false",
+        #   TTFB Threshold: p95 time to first byte in ms before the app is degraded (0 is disabled)
+        "ttfb_threshold": ttfbThreshold,
+        #   Flap Backoff: health check interval multiplier while the app is flapping (1 is disabled)
+        "flap_backoff": flapBackoff,
+        #   Tags: maintenance windows can be scheduled for every app with a tag
+        "tags": ",".join(tags),
+        #   Priority: critical, normal or low
+        "priority": priority,
+    }
+
+
 class HealthCheckerServer:
     TYPE = "_http._tcp.local."
     SERVICE_NAME = "_healthchecker"
     appname = ''
     monitorUrl = ''
     healthCheckerUrl = ''
+    healthCheckerAddr = None
+    udpSocket = None
 
     def __init__(self, app: str, url: str):
         self.appname = app
         self.monitorUrl = url
 
         # get the HealthChecker Server info from zeroconf
+        self.healthCheckerAddr = HealthCheckerServer.discover()
+        if self.healthCheckerAddr:
+            self.healthCheckerUrl = f"http://{self.healthCheckerAddr[0]}:{self.healthCheckerAddr[1]}/healthchecker/"
+        else:
+            self.healthCheckerUrl = "ServiceNotFound"
+
+    @staticmethod
+    def discover():
+        # (ip, port) of the HealthChecker Server advertised with zeroconf, None if it wasn't found
         r = Zeroconf()
-        hcInfo = r.get_service_info(HealthCheckerServer.TYPE, f"{HealthCheckerServer.SERVICE_NAME}.{HealthCheckerServer.TYPE}")
+        try:
+            hcInfo = r.get_service_info(HealthCheckerServer.TYPE, f"{HealthCheckerServer.SERVICE_NAME}.{HealthCheckerServer.TYPE}")
+        finally:
+            r.close()
         if hcInfo:
             # hcInfo.parsed_addresses()[0] is the IPV4 addr
-            self.healthCheckerUrl = f"http://{hcInfo.parsed_addresses()[0]}:{hcInfo.port}/healthchecker/"
-        else:
-            self.healthCheckerUrl = "ServiceNotFound"
-        r.close()
+            return hcInfo.parsed_addresses()[0], hcInfo.port
+        return None
 
     def __del__(self):
         self.stop()
@@ -233,23 +297,57 @@ class HealthCheckerServer:
                 timeout: int = MonitorValues.DEFAULT_TIME_OUT,
                 interval: int = MonitorValues.DEFAULT_INTERVAL,
                 unhealthy: int = MonitorValues.DEFAULT_UNHEALTHY_THRESHOLD,
-                healthy: int = MonitorValues.DEFAULT_HEALTHY_THRESHOLD):
-        params = {
-            "appname": self.appname,
-            "url": self.monitorUrl,
-            #   email addr to send email when unhealthy
-            "email": emailAddr,
-            #   Response Timeout: 5 sec (2-60sec)
-            "timeout": timeout,
-            #   HealthCheck Interval: 30 sec (5-300sec)
-            "interval": interval,
-            #   Unhealthy Threshold: 2 times (2-10)
-            "unhealthy_threshold": unhealthy,
-            #   Healthy Threshold: 10 time (2-10)
-            "healthy_threshold": healthy,
-        }
+                healthy: int = MonitorValues.DEFAULT_HEALTHY_THRESHOLD,
+                heartbeat: bool = False,
+                ttfbThreshold: int = MonitorValues.DEFAULT_TTFB_THRESHOLD,
+                flapBackoff: int = MonitorValues.DEFAULT_FLAP_BACKOFF,
+                tags: list = (),
+                priority: str = MonitorValues.DEFAULT_PRIORITY):
+        params = monitorParams(self.appname, self.monitorUrl, emailAddr, timeout, interval, unhealthy, healthy,
+                               heartbeat, ttfbThreshold, flapBackoff, tags, priority)
         return self.post("monitor", formDict=params)
 
+    def maintenance(self, duration: float, start: datetime = None, repeat: str = ''):
+        """
+        Schedule a maintenance window for this app, it isn't health checked during the window.
+
+        Parameters:
+            duration (float): seconds the maintenance lasts
+            start (datetime): when the maintenance starts, now if it isn't given
+            repeat (str): '', 'daily', 'weekly' or the seconds between maintenance windows
+
+        Returns:
+            int: HTTP status code, HTTP_201_CREATED when scheduled
+        """
+        return self.post("maintenance", formDict={
+            "appname": self.appname,
+            "duration": duration,
+            "start": start.isoformat() if start else "",
+            "repeat": repeat,
+        })
+
+    def heartbeat(self, udp: bool = False):
+        """
+        Tell the HealthChecker Server this app is alive, for apps registered with `monitor(heartbeat=True)`.
+
+        Parameters:
+            udp (bool): send a compact UDP datagram instead of an HTTP request, there is no response
+
+        Returns:
+            int: HTTP status code, HTTP_202_ACCEPTED when sent by UDP
+        """
+        if not udp:
+            return self.get("heartbeat", paramsDict={"appname": self.appname})
+        if self.healthCheckerAddr is None:
+            return status.HTTP_503_SERVICE_UNAVAILABLE
+        if self.udpSocket is None:
+            self.udpSocket = socket(AF_INET, SOCK_DGRAM)
+        try:
+            self.udpSocket.sendto(HEARTBEAT_DATAGRAM_PREFIX + self.appname.encode('utf-8'), self.healthCheckerAddr)
+            return status.HTTP_202_ACCEPTED
+        except OSError:
+            return status.HTTP_503_SERVICE_UNAVAILABLE
+
     def stop(self):
         return self.get("stop", paramsDict={"appname": self.appname})
 
@@ -1,5 +1,10 @@
+import asyncio
 import dataclasses
+from contextlib import contextmanager
 from datetime import datetime, timedelta
+from time import time, monotonic
+from functools import partial
+from threading import Thread, local
 import logging
 from os import path
 from socket import inet_pton, has_ipv6, AF_INET6, inet_aton
@@ -8,6 +13,7 @@ from typing import List
 import flask
 import waitress  # https://github.com/Pylons/waitress
 from apscheduler.schedulers.background import BackgroundScheduler  # https://github.com/agronholm/apscheduler
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from flask import request, make_response
 from flask.json import jsonify
 from flask.json import JSONEncoder
@@ -17,11 +23,29 @@ from zeroconf import Zeroconf, ServiceInfo  # https://github.com/jstasiak/python
 from validators import url, email, ip_address  # https://github.com/kvesteri/validators
 from click import command, option
 from click_config_file import configuration_option
-from healthcheck import requestsRetrySession, HealthCheckResponse, HealthStatus, MonitorValues
+from admission import ProbeDispatcher, PRIORITIES, RANKS
+from asgiapp import AsgiApp
+from availability import Availability
+from flapping import FlapDetector
+from export import StreamingBody, Importer, exportRecords, monitorRecord, checkRecord, ndjsonChunks, arrowChunks, \
+    pyarrow
+from healthcheck import HealthCheckResponse, HealthStatus, MonitorValues
+from heartbeat import HeartbeatMonitor
 from iputils import findFreePort, getMyIpAddr
+from probe import probe, asyncProbe, LatencyStats, ProbeTimings, dnsCache
+from probegroups import ProbeGroups
+from maintenance import MaintenanceWindows, MaintenanceWindow, REPEATS
+from monitorconfig import MonitorReconciler
+from registry import MonitorRegistry
+from replication import ReplicationLog, Standby
 from statemachine import Health
 from uptime import UpTime
 from sys import exit, version_info
+try:
+    import uvicorn  # https://github.com/encode/uvicorn
+except ImportError:
+    # only needed when running with `--asgi`
+    uvicorn = None
 if not version_info > (3, 7):
     print('Python3.7 is required to run this')
     exit(-1)
@@ -40,15 +64,30 @@ APP_NAME = "HealthChecker microservice"
 uptime = UpTime()
 
 # create background scheduler used for healthchecks
+#   replaced with an AsyncIOScheduler when running with `--asgi`
 logging.info("Starting scheduler.")
-sched = BackgroundScheduler(job_defaults={'misfire_grace_time': 15*60})
+SCHEDULER_JOB_DEFAULTS = {'misfire_grace_time': 15*60}
+sched = BackgroundScheduler(job_defaults=SCHEDULER_JOB_DEFAULTS)
 
 # TODO: look at adding a light db to this instead of a dict
 #  https://medium.com/@chetaniam/writing-a-simple-scheduling-service-with-apscheduler-dfbabc62e24a
 
-# Dictionary of apps monitor
-appsMonitored = {}
+# Dictionary of apps monitor, shared by the api and the scheduler threads
+appsMonitored = MonitorRegistry()
+
+# scheduled maintenance of apps and tags, apps in maintenance aren't health checked
+maintenance = MaintenanceWindows()
+
+# probes released by the scheduler are run by priority and deadline, shedding low priority ones under overload
+dispatcher = ProbeDispatcher()
+PROBE_WORKERS = 10
+ASYNC_PROBE_WORKERS = 100
+
+# deadlines of the push-mode (heartbeat) apps, they don't have a scheduler job
+heartbeats = HeartbeatMonitor()
 gmail = None
+# advertises the server, a warm standby only advertises itself once it takes over
+zeroConf = None
 
 
 def sendEmail(sendTo: str, messageBody: str = '', htmlMessageBody: str = '', emailSubject: str = ''):
@@ -74,16 +113,16 @@ def sendEmail(sendTo: str, messageBody: str = '', htmlMessageBody: str = '', ema
 
 
 # ---------------------
-# FLASK STUFF
+# API
+#   shared by the flask (waitress) and asgi front ends,
+#   each returns a tuple of (body, statusCode)
 # ---------------------
 
 
-@app.route('/health')
-def health():
-    logging.info(f"{APP_NAME} /health endpoint executing")
+def healthResponse():
     currentDatetime = datetime.now()
 
-    healthCheckResponse = HealthCheckResponse().status(HealthStatus.PASS)\
+    return HealthCheckResponse().status(HealthStatus.PASS)\
         .description(app=APP_NAME)\
         .releaseID('1.0.0')\
         .serviceID('')\
@@ -101,24 +140,37 @@ def health():
                 },
             ]
         })\
-        .custom('appsMonitored', [f'{appname} ({appdata["url"]})' for appname, appdata in appsMonitored.items()])\
-        .build()
-    return healthCheckResponse
-
-
-@app.route("/")
-def hello():
-    logging.info(f"{APP_NAME} root endpoint executing")
-    return f"{APP_NAME} uptime: " + str(uptime)
+        .custom('appsMonitored', [f'{appname} ({appdata.url})' for appname, appdata in appsMonitored.items()])\
+        .custom('dnsCache', dnsCache.stats())\
+        .custom('probeGroups', probeGroups.stats())\
+        .custom('probeDispatcher', dispatcher.stats())
 
 
 @dataclass
 class AppData:
     # endpoint connection details
     url: str = ''
+    emailAddr: str = ''
     timeout: int = MonitorValues.DEFAULT_TIME_OUT
     interval: int = MonitorValues.DEFAULT_INTERVAL
 
+    # app sends heartbeats instead of being polled
+    heartbeat: bool = False
+
+    # p95 time to first byte (ms) over which the app is DEGRADING, 0 is disabled
+    ttfbThreshold: int = MonitorValues.DEFAULT_TTFB_THRESHOLD
+
+    # health check interval multiplier while the app is flapping, 1 is disabled
+    flapBackoff: int = MonitorValues.DEFAULT_FLAP_BACKOFF
+
+    # maintenance windows can be scheduled for every app with a tag
+    tags: List[str] = field(default_factory=list)
+    inMaintenance: bool = False
+    paused: bool = False
+
+    # health checks of critical apps run first and low priority ones are shed when overloaded
+    priority: str = MonitorValues.DEFAULT_PRIORITY
+
     # statemachine
     healthState: Health = None
 
@@ -127,184 +179,741 @@ class AppData:
     lastcheck: datetime = None
     healthchecks: List[datetime] = field(default_factory=list)
 
+    # sliding window availability (1h/24h/7d/30d uptime, MTTR, MTBF)
+    availability: Availability = field(default_factory=Availability)
 
-@app.route('/healthchecker/monitor', methods=['POST'])
-def monitorRequest():
-    # - endpoint to register an app to monitor
-    global appsMonitored
+    # per phase (dns, connect, tls, ttfb, body) latency of the last health checks
+    latency: LatencyStats = field(default_factory=LatencyStats)
+
+    # weighted state change frequency of the last health checks
+    flapping: FlapDetector = field(default_factory=FlapDetector)
 
+
+def monitorApp(form):
+    # - register an app to monitor
     # check that the minimal required info is passed
-    appname = request.form['appname']
-    monitorUrl = request.form['url']
+    appname = form['appname']
+    monitorUrl = form['url']
     if appname is None or monitorUrl is None:
         logging.error(f"`{appname}` tried to register without the minimum parameters.")
-        return make_response(
+        return (
             f"Invalid parameters for app `{appname}`.\nMinimal request should have `appname` and `url` defined.",
             status.HTTP_400_BAD_REQUEST,
         )
 
     # if the app is trying to register again then there probably is something
     # wrong with the app.  Possibly erroring out and restarting?
-    if appname in appsMonitored:
+    appData = appsMonitored.get(appname)
+    if appData is not None:
         logging.warning(f"`{appname}` tried to reregister again.")
-        appData = appsMonitored[appname]
-        appData.healthState.unhealthyCheck()
-        sched.resume_job(job_id=appname)
-        return make_response(f"`{appname}` is already being monitored", status.HTTP_302_FOUND)
+        with recording(appname):
+            appData.healthState.unhealthyCheck()
+        resumeJob(appname, appData)
+        return f"`{appname}` is already being monitored", status.HTTP_302_FOUND
 
-    appname = request.form['appname']
-    monitorUrl = request.form['url']
     if not url(monitorUrl) and not ip_address.ipv4(monitorUrl) and not ip_address.ipv6(monitorUrl):
-        return make_response(f"`{monitorUrl}` is not a valid url", status.HTTP_400_BAD_REQUEST)
+        return f"`{monitorUrl}` is not a valid url", status.HTTP_400_BAD_REQUEST
 
-    emailAddr = request.form['email']
+    emailAddr = form['email']
     if not email(emailAddr):
-        return make_response(f"`{emailAddr}` is not a valid email", status.HTTP_400_BAD_REQUEST)
+        return f"`{emailAddr}` is not a valid email", status.HTTP_400_BAD_REQUEST
 
     #   Response Timeout: 5 sec (2-60sec)
-    timeout = int(request.form['timeout'])
+    timeout = int(form['timeout'])
     #   HealthCheck Interval: 30 sec (5-300sec)
-    interval = int(request.form['interval'])
+    interval = int(form['interval'])
     #   Unhealthy Threshold: 2 times (2-10)
-    unhealthy_threshold = int(request.form['unhealthy_threshold'])
+    unhealthy_threshold = int(form['unhealthy_threshold'])
     #   Healthy Threshold: 10 time (2-10)
-    healthy_threshold = int(request.form['healthy_threshold'])
+    healthy_threshold = int(form['healthy_threshold'])
+    #   Heartbeat: app will call `heartbeat` every interval instead of being polled
+    heartbeat = form.get('heartbeat', '').lower() in ('1', 'true')
+    #   TTFB Threshold: p95 time to first byte in ms before the app is degraded (0 is disabled)
+    ttfb_threshold = int(form.get('ttfb_threshold', MonitorValues.DEFAULT_TTFB_THRESHOLD))
+    #   Flap Backoff: health check interval multiplier while the app is flapping (1 is disabled)
+    flap_backoff = int(form.get('flap_backoff', MonitorValues.DEFAULT_FLAP_BACKOFF))
+    #   Tags: comma separated, i.e. to schedule maintenance for a group of apps
+    tags = [tag.strip() for tag in form.get('tags', '').split(',') if tag.strip()]
+    #   Priority: critical, normal or low
+    priority = form.get('priority', '') or MonitorValues.DEFAULT_PRIORITY
 
     # make sure the parameters are sane
-    if (
-        MonitorValues.MIN_TIMEOUT >= timeout <= MonitorValues.MAX_TIMEOUT
-        and MonitorValues.MIN_INTERVAL >= interval <= MonitorValues.MAX_INTERVAL
-        and MonitorValues.MIN_HEALTHY_THRESHOLD >= healthy_threshold <= MonitorValues.MAX_HEALTHY_THRESHOLD
-        and MonitorValues.MIN_UNHEALTHY_THRESHOLD >= unhealthy_threshold <= MonitorValues.MAX_UNHEALTHY_THRESHOLD
-    ):
-        # store off the parameters for the job
-        appsMonitored[appname] = AppData(
-            monitorUrl, timeout, interval,
-            Health(unhealthyThreshold=unhealthy_threshold, healthyThreshold=healthy_threshold)
+    if validMonitorValues(timeout, interval, unhealthy_threshold, healthy_threshold, ttfb_threshold, flap_backoff, priority):
+        # store off the parameters for the job, another request may have registered the app meanwhile
+        appData = AppData(
+            url=monitorUrl, emailAddr=emailAddr, timeout=timeout, interval=interval,
+            heartbeat=heartbeat, ttfbThreshold=ttfb_threshold, flapBackoff=flap_backoff, tags=tags,
+            priority=priority,
+            healthState=Health(unhealthyThreshold=unhealthy_threshold, healthyThreshold=healthy_threshold),
         )
+        if not appsMonitored.add(appname, appData):
+            return f"`{appname}` is already being monitored", status.HTTP_302_FOUND
+        replicationLog.append(monitorRecord(appname, appData))
 
         # if there is an email register it with the statemachine
         if emailAddr and gmail:
             logging.info(f"Registering email for `{appname}` to {emailAddr}.")
-            appsMonitored[appname].healthState.registerEmail(
-                appname=appname, emailAddr=emailAddr, emailCallback=sendEmail
+            appData.healthState.registerEmail(
+                appname=appname, emailAddr=emailAddr, emailCallback=notify
             )
 
-        # create a job with the above parameters
-        logging.info(f"Scheduling health check job for `{appname}` to {monitorUrl} at {interval} seconds intervals.")
-        sched.add_job(lambda: healthCheck(appname), "interval", seconds=interval, id=appname)
+        if heartbeat:
+            # the app has `timeout` seconds of grace after each interval to send its heartbeat
+            logging.info(f"Expecting heartbeats from `{appname}` at {interval} seconds intervals.")
+            heartbeats.register(appname, interval, grace=timeout)
+        else:
+            # monitors of the same url and timeout share a scheduler job
+            logging.info(f"Scheduling health check job for `{appname}` to {monitorUrl} at {interval} seconds intervals.")
+            probeGroups.subscribe(appname, monitorUrl, timeout, interval)
 
         # return request created
-        return make_response(
-            f"App `{appname}` is scheduled for health check monitoring.",
-            status.HTTP_201_CREATED,
-        )
+        return f"App `{appname}` is scheduled for health check monitoring.", status.HTTP_201_CREATED
     else:
         # return error processing
         logging.error(f"`{appname}` tried to register with the invalid parameters.")
-        return make_response(
+        return (
             f"One or more parameters for app `{appname}` out of range.\nPlease refer to docs for valid parameter ranges.",
             status.HTTP_406_NOT_ACCEPTABLE,
         )
 
 
-# This is the scheduled job that checks the status of the app
-def healthCheck(appname: str):
-    # TODO: check that appname is in appsMonitored[]
+def validMonitorValues(timeout, interval, unhealthy_threshold, healthy_threshold, ttfb_threshold, flap_backoff, priority):
+    return (
+        MonitorValues.MIN_TIMEOUT <= timeout <= MonitorValues.MAX_TIMEOUT
+        and MonitorValues.MIN_INTERVAL <= interval <= MonitorValues.MAX_INTERVAL
+        and MonitorValues.MIN_HEALTHY_THRESHOLD <= healthy_threshold <= MonitorValues.MAX_HEALTHY_THRESHOLD
+        and MonitorValues.MIN_UNHEALTHY_THRESHOLD <= unhealthy_threshold <= MonitorValues.MAX_UNHEALTHY_THRESHOLD
+        and 0 <= ttfb_threshold <= MonitorValues.MAX_TTFB_THRESHOLD
+        and 1 <= flap_backoff <= MonitorValues.MAX_FLAP_BACKOFF
+        and priority in PRIORITIES
+    )
 
-    logging.info(f"Doing healthcheck for `{appname}`.")
-    # thread worker to monitor an app
-    appData = appsMonitored[appname]
-    healthUrl = appData.url + "/health"
-    healthTimeout = appData.timeout
 
-    # make the request to the <appUrl>/health endpoint
+# monitor settings that are changed without registering the app again
+UPDATABLE_SETTINGS = {
+    'interval', 'unhealthy_threshold', 'healthy_threshold', 'ttfb_threshold', 'flap_backoff', 'tags', 'priority',
+}
+
+
+def updateMonitor(appname: str, form):
+    # - change the `UPDATABLE_SETTINGS` of an app in place, its health and history are kept
+    appData = appsMonitored.get(appname)
+    if appData is None:
+        return f"App `{appname}` is not health check monitored.", status.HTTP_400_BAD_REQUEST
     try:
-        getHeaders = {
-            'Content-Type': 'application/health+json',
-            'Cache-Control': 'max-age=3600',
-            'Connection': 'close',
-        }
-        response = requestsRetrySession().get(healthUrl, headers=getHeaders, timeout=healthTimeout)
-        statusCode = response.status_code
-    except Exception:
-        statusCode = status.HTTP_500_INTERNAL_SERVER_ERROR
-
-    # keep the last healthcheck times
-    appData.lastcheck = datetime.now()
-    appData.healthchecks.append((appData.lastcheck, statusCode))
-    if len(appData.healthchecks) > appData.healthState.healthyThreshold:
-        appData.healthchecks.pop(0)
-
-    # if in unhealthy state wait till it meets the requirements for healthy again
-    if statusCode == status.HTTP_200_OK:
-        # healthcheck was successful
-        appData.healthState.healthyCheck()
-        if appData.healthState.isHealthy():
-            appData.lasthealthy = datetime.now()
+        interval = int(form['interval'])
+        unhealthy_threshold = int(form['unhealthy_threshold'])
+        healthy_threshold = int(form['healthy_threshold'])
+        ttfb_threshold = int(form['ttfb_threshold'])
+        flap_backoff = int(form['flap_backoff'])
+    except (KeyError, ValueError) as e:
+        return f"Invalid parameters for app `{appname}`: {e}", status.HTTP_400_BAD_REQUEST
+    priority = form.get('priority', '') or MonitorValues.DEFAULT_PRIORITY
+    if not validMonitorValues(appData.timeout, interval, unhealthy_threshold, healthy_threshold, ttfb_threshold,
+                              flap_backoff, priority):
+        logging.error(f"`{appname}` tried to update with the invalid parameters.")
+        return f"One or more parameters for app `{appname}` out of range.", status.HTTP_406_NOT_ACCEPTABLE
+
+    with appsMonitored.lock(appname):
+        appData.healthState.unhealthyThreshold = unhealthy_threshold
+        appData.healthState.healthyThreshold = healthy_threshold
+        appData.ttfbThreshold = ttfb_threshold
+        appData.flapBackoff = flap_backoff
+        appData.tags = [tag.strip() for tag in form.get('tags', '').split(',') if tag.strip()]
+        appData.priority = priority
+        rescheduled = interval != appData.interval
+        appData.interval = interval
+    if rescheduled:
+        logging.info(f"Health checks for `{appname}` changed to {interval} seconds intervals.")
+        if appData.heartbeat:
+            heartbeats.register(appname, interval, grace=appData.timeout)
+            if appData.paused:
+                heartbeats.pause(appname)
+        else:
+            rescheduleJob(appname, appData, interval * (appData.flapBackoff if appData.flapping.flapping else 1))
+    replicationLog.append({**monitorRecord(appname, appData), 'type': 'update'})
+    return 'OK', status.HTTP_200_OK
+
+
+def stopMonitoringApp(appname: str):
+    # - deregister app
+    appData = appsMonitored.pop(appname)
+    if appData is not None:
+        removeJob(appname, appData)
+        replicationLog.append({'type': 'stop', 'appname': appname})
+        return 'OK', status.HTTP_200_OK
     else:
-        # TODO: need to allow for a DEGRADED status code to be returned (HTTP 201 to HTTP 307)
+        return f"App `{appname}` is not health check monitored.", status.HTTP_400_BAD_REQUEST
 
-        # healthcheck was not successful
-        appData.healthState.unhealthyCheck()
 
-        # pause any jobs that are reporting unhealthy for over a day
-        if appData.healthState.isUnhealthy() and \
-                appData.lasthealthy and (datetime.now() - appData.lasthealthy) > timedelta(days=1):
-            # tell the scheduler to pause this job
-            sched.pause_job(appname)
+def pauseApp(appname: str):
+    # - pause monitoring
+    appData = appsMonitored.get(appname)
+    if appData is not None:
+        pauseJob(appname, appData)
+        return 'OK', status.HTTP_200_OK
+    else:
+        return f'App `{appname}` is not health check monitored.', status.HTTP_400_BAD_REQUEST
 
-            sendEmail(appData.emailAddr, f'Last healthy check: {appData.lasthealthy}', '',
-                      f"Monitoring for `{appname}` has been paused")
 
+def resumeApp(appname: str):
+    # - resume monitoring
+    appData = appsMonitored.get(appname)
+    if appData is not None:
+        resumeJob(appname, appData)
+        return 'OK', status.HTTP_200_OK
+    else:
+        return f'App `{appname}` is not health check monitored.', status.HTTP_400_BAD_REQUEST
 
-@app.route("/healthchecker/stopmonitoring", methods=["GET"])
-def stopmonitoring():
-    # - endpoint to deregister app “stopmonitoring?<appName>”
-    appname = request.args.get('appname')
-    if appname in appsMonitored:
-        del appsMonitored[appname]
-        sched.remove_job(appname)
-        return make_response('OK', status.HTTP_200_OK)
+
+def heartbeatApp(appname: str):
+    # - heartbeat from a push-mode app, kept as light as possible
+    if heartbeats.beat(appname):
+        return 'OK', status.HTTP_200_OK
+    return f'App `{appname}` is not heartbeat monitored.', status.HTTP_400_BAD_REQUEST
+
+
+def addMaintenance(form):
+    # - schedule a maintenance window for an app or every app with a tag
+    try:
+        start = datetime.fromisoformat(form['start']).timestamp() if form.get('start') else time()
+        duration = float(form['duration'])
+        repeat = form.get('repeat', '')
+        repeat = REPEATS[repeat] if repeat in REPEATS else float(repeat)
+    except (KeyError, ValueError) as e:
+        return f"Invalid maintenance window: {e}", status.HTTP_400_BAD_REQUEST
+    try:
+        window = maintenance.add(start, duration, appname=form.get('appname') or None, tag=form.get('tag') or None,
+                                 repeat=repeat)
+    except ValueError as e:
+        logging.error(f"Tried to schedule a maintenance window with invalid parameters: {e}")
+        return f"Maintenance window out of range: {e}", status.HTTP_406_NOT_ACCEPTABLE
+    logging.info(f"Scheduled maintenance window {window}.")
+    replicationLog.append({'type': 'maintenance', **dataclasses.asdict(window)})
+    return dataclasses.asdict(window), status.HTTP_201_CREATED
+
+
+def listMaintenance():
+    return [dataclasses.asdict(window) for window in maintenance.list()], status.HTTP_200_OK
+
+
+def cancelMaintenance(windowId: str):
+    if windowId is None or not windowId.isdigit() or not maintenance.remove(int(windowId)):
+        return f"Maintenance window `{windowId}` is not scheduled.", status.HTTP_400_BAD_REQUEST
+    replicationLog.append({'type': 'cancel', 'id': int(windowId)})
+    return 'OK', status.HTTP_200_OK
+
+
+def appInfo(appname: str):
+    # all the info for a monitored app
+    if appname is None:
+        return "`appname` parameter not specified.", status.HTTP_400_BAD_REQUEST
+    appData = appsMonitored.get(appname)
+    if appData is None:
+        return f'App `{appname}` is not health check monitored.', status.HTTP_400_BAD_REQUEST
+    # copied under the app's lock so a health check can't change it half way through
+    with appsMonitored.lock(appname):
+        return dataclasses.asdict(appData), status.HTTP_200_OK
+
+
+def exportApps(exportFormat: str = 'ndjson'):
+    # stream all the monitored apps and their health checks
+    if exportFormat == 'arrow':
+        if pyarrow is None:
+            return '`pyarrow` is required to export in the Arrow format.', status.HTTP_501_NOT_IMPLEMENTED
+        return StreamingBody(arrowChunks(exportRecords(appsMonitored)), 'application/vnd.apache.arrow.stream'), \
+            status.HTTP_200_OK
+    if exportFormat != 'ndjson':
+        return f'`{exportFormat}` is not a supported export format.', status.HTTP_400_BAD_REQUEST
+    return StreamingBody(ndjsonChunks(exportRecords(appsMonitored)), 'application/x-ndjson'), status.HTTP_200_OK
+
+
+def importMonitor(record: dict):
+    # apps that are already monitored are skipped rather than treated as reregistering
+    if record['appname'] in appsMonitored:
+        return False
+    _, statusCode = monitorApp({key: str(value) for key, value in record.items()})
+    return statusCode == status.HTTP_201_CREATED
+
+
+def importCheck(record: dict):
+    appData = appsMonitored.get(record['appname'])
+    if appData is None:
+        return False
+    timings = ProbeTimings(**record['timings']) if record.get('timings') else None
+    with appsMonitored.lock(record['appname']):
+        appData.healthchecks.append((datetime.fromisoformat(record['time']), int(record['statusCode']), timings))
+        if len(appData.healthchecks) > appData.healthState.healthyThreshold:
+            appData.healthchecks.pop(0)
+    replicationLog.append({**record, 'type': 'check'})
+    return True
+
+
+def importApps(params=None):
+    # consumer the ndjson export is fed to
+    return Importer(importMonitor, importCheck)
+
+
+def statusSnapshot():
+    # TODO: make this an interactive page
+    # all the apps monitored and last status
+    return appsMonitored.snapshot(), status.HTTP_501_NOT_IMPLEMENTED
+
+
+# ---------------------
+# HEALTH CHECKS
+# ---------------------
+
+
+def scheduleProbeGroup(probeKey: str, before: int, after: int):
+    # one scheduler job per probe group running at the fastest interval of its monitors
+    if after is None:
+        sched.remove_job(probeKey)
+        dispatcher.forget(probeKey)
+    elif before is None:
+        sched.add_job(releaseJob, "interval", seconds=after, id=probeKey, args=[probeKey])
     else:
-        return make_response(
-            f"App `{appname}` is not health check monitored.",
-            status.HTTP_400_BAD_REQUEST,
-        )
+        logging.info(f"Rescheduling health check job for {probeKey} at {after} seconds intervals.")
+        sched.reschedule_job(probeKey, trigger='interval', seconds=after)
 
 
-@app.route('/healthchecker/pause', methods=["GET"])
-def pause():
-    # - endpoint to pause monitoring “pause?<appName>”
-    appname = request.args.get('appname')
-    if appname in appsMonitored:
-        sched.pause_job(appname)
-        return make_response('OK', status.HTTP_200_OK)
+# monitors sharing a url and timeout are probed once for all of them
+probeGroups = ProbeGroups(onIntervalChange=scheduleProbeGroup)
+
+
+def pauseJob(appname: str, appData: AppData):
+    if appData.heartbeat:
+        heartbeats.pause(appname)
     else:
-        return make_response(
-            f'App `{appname}` is not health check monitored.',
-            status.HTTP_400_BAD_REQUEST,
-        )
+        probeGroups.pause(appname, appData.url, appData.timeout)
+    appData.paused = True
+    replicationLog.append(stateRecord(appname, appData))
 
 
-@app.route('/healthchecker/resume', methods=['GET'])
-def resume():
-    # - endpoint to resume monitoring “resume?<appName>"
-    appname = request.args.get('appname')
-    if appname in appsMonitored:
-        sched.resume_job(appname)
-        return make_response('OK', status.HTTP_200_OK)
+def resumeJob(appname: str, appData: AppData):
+    if appData.heartbeat:
+        heartbeats.resume(appname)
     else:
-        return make_response(f'App `{appname}` is not health check monitored.', status.HTTP_400_BAD_REQUEST)
+        probeGroups.resume(appname, appData.url, appData.timeout)
+    appData.paused = False
+    replicationLog.append(stateRecord(appname, appData))
 
 
-@app.route('/healthchecker/info')
-def info():
-    # show a webpage with all the apps monitored and last status
-    appname = request.args.get('appname', None)
-    if appname is None:
-        return make_response("`appname` parameter not specified.", status.HTTP_400_BAD_REQUEST)
-    return make_response(jsonify(dataclasses.asdict(appsMonitored[appname])), status.HTTP_200_OK)
+def rescheduleJob(appname: str, appData: AppData, interval: int):
+    # heartbeat apps push at their own interval, a shared probe keeps running at the fastest interval
+    if not appData.heartbeat:
+        probeGroups.subscribe(appname, appData.url, appData.timeout, interval)
+
+
+def removeJob(appname: str, appData: AppData):
+    if appData.heartbeat:
+        heartbeats.remove(appname)
+    else:
+        probeGroups.unsubscribe(appname, appData.url, appData.timeout)
+
+
+HEALTHCHECK_HEADERS = {
+    'Content-Type': 'application/health+json',
+    'Cache-Control': 'max-age=3600',
+    'Connection': 'close',
+}
+
+
+# This is the scheduled job of a probe group, the health check runs when the dispatcher gets to it
+def releaseProbe(probeKey: str):
+    target = probeGroups.target(probeKey)
+    interval = probeGroups.interval(probeKey)
+    if target is None or interval is None:
+        return
+    # the group is as urgent as its most urgent app
+    priorities = [appData.priority for appData in map(appsMonitored.get, target[2]) if appData is not None]
+    dispatcher.submit(probeKey, min(priorities, key=RANKS.get, default=MonitorValues.DEFAULT_PRIORITY), interval)
+
+
+# the asyncio scheduler runs plain functions in a thread pool, the dispatcher's workers are woken up in the event loop
+async def asyncReleaseProbe(probeKey: str):
+    releaseProbe(probeKey)
+
+
+# job the scheduler runs for each probe group, `asyncReleaseProbe` when running under asgi
+releaseJob = releaseProbe
+
+
+# This is the health check of the apps sharing a probe
+def healthCheck(probeKey: str):
+    target = probeGroups.target(probeKey)
+    if target is None:
+        # the apps stopped being monitored while this job was waiting to run
+        logging.info(f"{probeKey} is no longer monitored.")
+        return
+    url, timeout, appnames = notInMaintenance(target)
+    if not appnames:
+        return
+    logging.info(f"Doing healthcheck for {', '.join(f'`{appname}`' for appname in appnames)}.")
+
+    # make the request to the <appUrl>/health endpoint
+    try:
+        statusCode, timings = probe(url + "/health", headers=HEALTHCHECK_HEADERS, timeout=timeout)
+    except Exception:
+        statusCode, timings = status.HTTP_500_INTERNAL_SERVER_ERROR, None
+
+    fanOutResult(appnames, statusCode, timings)
+
+
+# This is the health check of the apps sharing a probe when running in the asgi event loop
+async def asyncHealthCheck(probeKey: str):
+    target = probeGroups.target(probeKey)
+    if target is None:
+        logging.info(f"{probeKey} is no longer monitored.")
+        return
+    url, timeout, appnames = notInMaintenance(target)
+    if not appnames:
+        return
+    logging.info(f"Doing healthcheck for {', '.join(f'`{appname}`' for appname in appnames)}.")
+
+    # make the request to the <appUrl>/health endpoint
+    try:
+        statusCode, timings = await asyncProbe(url + "/health", headers=HEALTHCHECK_HEADERS, timeout=timeout)
+    except Exception:
+        statusCode, timings = status.HTTP_500_INTERNAL_SERVER_ERROR, None
+
+    fanOutResult(appnames, statusCode, timings)
+
+
+def notInMaintenance(target):
+    # the probe target without the apps that are in maintenance, if they all are there is nothing to probe
+    url, timeout, appnames = target
+    now = time()
+    return url, timeout, [appname for appname in appnames if not inMaintenance(appname, now)]
+
+
+def inMaintenance(appname: str, now: float = None):
+    appData = appsMonitored.get(appname)
+    if appData is None:
+        return True
+    until = maintenance.until(appname, appData.tags, now)
+    with appsMonitored.lock(appname):
+        if until is not None:
+            if not appData.inMaintenance:
+                logging.info(f"`{appname}` is in maintenance until {datetime.fromtimestamp(until)}.")
+                appData.inMaintenance = True
+                appData.availability.pause()
+            return True
+        if appData.inMaintenance:
+            # the health from before the maintenance doesn't count anymore
+            logging.info(f"`{appname}` maintenance is over.")
+            appData.inMaintenance = False
+            appData.availability.pause()
+            appData.healthState.unknown()
+            appData.healthState.resetChecks()
+            if appData.flapping.flapping and appData.flapBackoff > 1:
+                # back to the interval the health checks were backed off from
+                rescheduleJob(appname, appData, appData.interval)
+            appData.flapping = FlapDetector()
+            replicationLog.append(stateRecord(appname, appData))
+    return False
+
+
+def fanOutResult(appnames: list, statusCode: int, timings: ProbeTimings = None):
+    # every app sharing the probe gets its result
+    for appname in appnames:
+        appData = appsMonitored.get(appname)
+        if appData is not None:
+            healthCheckResult(appname, appData, statusCode, timings)
+
+
+# This is the scheduled job that feeds the heartbeat deadlines into the statemachine
+def checkHeartbeats():
+    for appname, healthy in heartbeats.expire():
+        appData = appsMonitored.get(appname)
+        if appData and not inMaintenance(appname):
+            if not healthy:
+                logging.info(f"Missed heartbeat from `{appname}`.")
+            healthCheckResult(appname, appData, status.HTTP_200_OK if healthy else status.HTTP_408_REQUEST_TIMEOUT)
+
+
+# the emails and job changes of a result held back while the app's lock is held
+deferred = local()
+
+
+def notify(**email):
+    # the statemachine's email callback, sent once the app's lock is released
+    pending = getattr(deferred, 'actions', None)
+    if pending is None:
+        sendEmail(**email)
+    else:
+        pending.append(partial(sendEmail, **email))
+
+
+@contextmanager
+def recording(appname: str):
+    # hold the app's lock to record a result, the emails and job changes it causes run after releasing it
+    deferred.actions = actions = []
+    try:
+        with appsMonitored.lock(appname):
+            yield actions
+    finally:
+        deferred.actions = None
+    for action in actions:
+        action()
+
+
+def ifMonitored(appname: str, appData: AppData, job, *args):
+    # a deferred job change, skipped if the app was stopped or replaced meanwhile
+    def change():
+        if appsMonitored.get(appname) is appData:
+            job(appname, appData, *args)
+    return change
+
+
+def healthCheckResult(appname: str, appData: AppData, statusCode: int, timings: ProbeTimings = None):
+    # results are recorded under the app's lock, the app may have been stopped or replaced while probing
+    with recording(appname) as after:
+        if appsMonitored.get(appname) is not appData:
+            logging.info(f"`{appname}` is no longer monitored, dropping its health check result.")
+            return
+
+        # keep the last healthcheck times
+        appData.lastcheck = datetime.now()
+        appData.healthchecks.append((appData.lastcheck, statusCode, timings))
+        if len(appData.healthchecks) > appData.healthState.healthyThreshold:
+            appData.healthchecks.pop(0)
+
+        slow = False
+        if timings is not None:
+            appData.latency.add(timings)
+            slow = appData.ttfbThreshold and appData.latency.percentile('ttfb', 95) > appData.ttfbThreshold
+
+        # damp apps that keep changing health
+        if statusCode != status.HTTP_200_OK:
+            result = 'failed'
+        else:
+            result = 'slow' if slow else 'ok'
+        if appData.flapping.update(result):
+            flappingChanged(appname, appData, after)
+
+        # if in unhealthy state wait till it meets the requirements for healthy again
+        if appData.healthState.isFlapping():
+            # the statemachine ignores the checks (and sends no emails) until the app settles
+            pass
+        elif statusCode == status.HTTP_200_OK and slow:
+            # healthcheck was successful but the app is responding too slowly
+            logging.info(f"`{appname}` p95 time to first byte is over {appData.ttfbThreshold}ms.")
+            appData.healthState.degradedCheck()
+        elif statusCode == status.HTTP_200_OK:
+            # healthcheck was successful
+            appData.healthState.healthyCheck()
+            if appData.healthState.isHealthy():
+                appData.lasthealthy = datetime.now()
+        else:
+            # TODO: need to allow for a DEGRADED status code to be returned (HTTP 201 to HTTP 307)
+
+            # healthcheck was not successful
+            appData.healthState.unhealthyCheck()
+
+            # pause any jobs that are reporting unhealthy for over a day
+            if appData.healthState.isUnhealthy() and \
+                    appData.lasthealthy and (datetime.now() - appData.lasthealthy) > timedelta(days=1):
+                # tell the scheduler to pause this job
+                after.append(ifMonitored(appname, appData, pauseJob))
+
+                after.append(partial(sendEmail, appData.emailAddr, f'Last healthy check: {appData.lasthealthy}', '',
+                                     f"Monitoring for `{appname}` has been paused"))
+
+        # update the availability counters with the result of this check
+        appData.availability.update(
+            statusCode == status.HTTP_200_OK,
+            unhealthy=appData.healthState.state == Health.States.UNHEALTHY,
+        )
+
+        # the standbys replay the check and take the state (and flap detection) it left the app in
+        replicationLog.append({
+            **checkRecord(appname, appData.lastcheck, statusCode, timings),
+            **stateRecord(appname, appData),
+            'type': 'result',
+        })
+
+
+def flappingChanged(appname: str, appData: AppData, after: list):
+    # the app started or stopped flapping, optionally backing off the health checks meanwhile
+    percent = appData.flapping.percentStateChange()
+    if appData.flapping.flapping:
+        logging.warning(f"`{appname}` is flapping ({percent:.1f}% state change).")
+        appData.healthState.startFlapping()
+        if appData.flapBackoff > 1:
+            after.append(ifMonitored(appname, appData, rescheduleJob, appData.interval * appData.flapBackoff))
+    else:
+        logging.info(f"`{appname}` stopped flapping ({percent:.1f}% state change).")
+        appData.healthState.stopFlapping()
+        if appData.flapBackoff > 1:
+            after.append(ifMonitored(appname, appData, rescheduleJob, appData.interval))
+
+
+# ---------------------
+# REPLICATION
+# ---------------------
+
+
+def stateRecord(appname: str, appData: AppData):
+    return {
+        'type': 'state',
+        'appname': appname,
+        'state': appData.healthState.state.name,
+        'healthyChecks': appData.healthState.healthyChecks,
+        'unhealthyChecks': appData.healthState.unhealthyChecks,
+        'lasthealthy': appData.lasthealthy.isoformat() if appData.lasthealthy else None,
+        'lastcheck': appData.lastcheck.isoformat() if appData.lastcheck else None,
+        'paused': appData.paused,
+        'flapDetector': appData.flapping.snapshot(),
+    }
+
+
+def replicationSnapshot():
+    # everything a standby that just connected needs, followed by the log
+    for window in maintenance.list():
+        yield {'type': 'maintenance', **dataclasses.asdict(window)}
+    for appname in list(appsMonitored):
+        appData = appsMonitored.get(appname)
+        if appData is None:
+            continue
+        # an app's checks and state are taken together, the results shipped after them with a later check are new
+        with appsMonitored.lock(appname):
+            records = [monitorRecord(appname, appData)]
+            records += [checkRecord(appname, *check) for check in appData.healthchecks]
+            records.append(stateRecord(appname, appData))
+        yield from records
+
+
+# registry changes and health check results shipped to the warm standbys
+replicationLog = ReplicationLog(replicationSnapshot)
+
+
+def applyReplicated(record: dict):
+    # a standby applies the primary's records, its scheduler is paused so nothing is probed until it takes over
+    kind = record['type']
+    if kind == 'reset':
+        for appname in list(appsMonitored):
+            stopMonitoringApp(appname)
+        for window in maintenance.list():
+            maintenance.remove(window.id)
+    elif kind == 'monitor':
+        importMonitor(record)
+    elif kind == 'check':
+        importCheck(record)
+    elif kind == 'result':
+        appData = appsMonitored.get(record['appname'])
+        checkTime = datetime.fromisoformat(record['time'])
+        if appData is None or (appData.lastcheck is not None and checkTime <= appData.lastcheck):
+            # the snapshot taken when the standby connected already has this result
+            return
+        if not importCheck(record):
+            return
+        with appsMonitored.lock(record['appname']):
+            appData.lastcheck = checkTime
+            if record['timings']:
+                appData.latency.add(ProbeTimings(**record['timings']))
+            appData.availability.update(
+                record['statusCode'] == status.HTTP_200_OK, unhealthy=record['state'] == Health.States.UNHEALTHY.name,
+                now=appData.lastcheck.timestamp(),
+            )
+        restoreState(record)
+    elif kind == 'state':
+        restoreState(record)
+    elif kind == 'update':
+        updateMonitor(record['appname'], {key: str(value) for key, value in record.items()})
+    elif kind == 'stop':
+        stopMonitoringApp(record['appname'])
+    elif kind == 'maintenance':
+        maintenance.restore(MaintenanceWindow(**{key: value for key, value in record.items() if key != 'type'}))
+    elif kind == 'cancel':
+        maintenance.remove(record['id'])
+
+
+def restoreState(record: dict):
+    appData = appsMonitored.get(record['appname'])
+    if appData is None:
+        return
+    lastcheck = datetime.fromisoformat(record['lastcheck']) if record['lastcheck'] else None
+    if appData.lastcheck is not None and (lastcheck is None or lastcheck < appData.lastcheck):
+        # older than the snapshot the standby has
+        return
+    with appsMonitored.lock(record['appname']):
+        appData.lastcheck = lastcheck
+        appData.healthState.restore(record['state'], record['healthyChecks'], record['unhealthyChecks'])
+        appData.lasthealthy = datetime.fromisoformat(record['lasthealthy']) if record['lasthealthy'] else None
+        # the app has to be able to stop flapping once the standby takes over
+        appData.flapping.restore(record['flapDetector'])
+    if record['paused'] != appData.paused:
+        (pauseJob if record['paused'] else resumeJob)(record['appname'], appData)
+
+
+def followPrimary(primaryAddr: tuple, bindAddr: str, port: int, replicatePort: int, monitorsFile: str):
+    # run as a warm standby until the primary is gone then take over
+    lastHeard = Standby(primaryAddr, applyReplicated).follow()
+    takeOver(bindAddr, port, replicatePort, lastHeard)
+    if monitorsFile:
+        watchMonitors(monitorsFile)
+
+
+def takeOver(bindAddr: str, port: int, replicatePort: int, lastHeard: float):
+    global zeroConf
+    logging.warning(f'Primary is gone, taking over monitoring {len(appsMonitored)} apps.')
+    for appname, appData in appsMonitored.items():
+        if appData.heartbeat:
+            # the apps get a full interval to send their first heartbeat to this server
+            heartbeats.rearm(appname, grace=appData.timeout)
+        elif appData.flapping.flapping and appData.flapBackoff > 1:
+            rescheduleJob(appname, appData, appData.interval * appData.flapBackoff)
+    sched.resume()
+    logging.warning(f'Took over from the primary {monotonic() - lastHeard:.2f}s after it was last heard from.')
+    if replicatePort:
+        replicationLog.serve(bindAddr, replicatePort)
+    zeroConf = registerService(bindAddr, port)
+
+
+# ---------------------
+# DECLARED MONITORS
+# ---------------------
+
+
+def applyMonitorForm(appname: str, form: dict):
+    # register an app declared in the monitors file or bring its settings in line with the file
+    appData = appsMonitored.get(appname)
+    if appData is None:
+        body, statusCode = monitorApp(form)
+        if statusCode != status.HTTP_201_CREATED:
+            logging.error(f"Could not register `{appname}` from the monitors file: {body}")
+        return statusCode == status.HTTP_201_CREATED
+
+    current = monitorRecord(appname, appData)
+    changed = {key for key, value in form.items() if key in current and value != str(current[key])}
+    if not changed:
+        return True
+    if changed <= UPDATABLE_SETTINGS:
+        _, statusCode = updateMonitor(appname, form)
+        return statusCode == status.HTTP_200_OK
+    # a new url, timeout, email or heartbeat is a new monitor
+    logging.info(f"`{appname}` {', '.join(sorted(changed))} changed, registering it again.")
+    stopMonitoringApp(appname)
+    _, statusCode = monitorApp(form)
+    return statusCode == status.HTTP_201_CREATED
+
+
+def removeMonitor(appname: str):
+    logging.info(f"`{appname}` was taken out of the monitors file.")
+    stopMonitoringApp(appname)
+
+
+def watchMonitors(filename: str):
+    # the monitors in the file are registered before serving and the file is reconciled whenever it changes
+    reconciler = MonitorReconciler(filename, applyMonitorForm, removeMonitor)
+    try:
+        reconciler.changed()
+        logging.info(f'Monitors in {filename}: {reconciler.reconcile()}')
+    except (OSError, ValueError, TypeError, AttributeError) as e:
+        logging.error(f'Could not read the monitors in {filename}: {e}')
+    reconciler.watch()
+    return reconciler
 
 
 class CustomJSONEncoder(JSONEncoder):
@@ -318,14 +927,148 @@ class CustomJSONEncoder(JSONEncoder):
                 'healthyThreshold': obj.healthyThreshold,
                 'currentHealth': obj.state.name,
             }
+        if isinstance(obj, (Availability, LatencyStats, FlapDetector)):
+            return obj.report()
         return JSONEncoder.default(self, obj)
 
 
+# ---------------------
+# FLASK STUFF
+# ---------------------
+
+
+def flaskResponse(body, statusCode):
+    if isinstance(body, StreamingBody):
+        # waitress sends a generator with chunked transfer encoding
+        return flask.Response(iter(body), status=statusCode, mimetype=body.contentType)
+    return make_response(body if isinstance(body, str) else jsonify(body), statusCode)
+
+
+@app.route('/health')
+def health():
+    logging.info(f"{APP_NAME} /health endpoint executing")
+    return healthResponse().build()
+
+
+@app.route("/")
+def hello():
+    logging.info(f"{APP_NAME} root endpoint executing")
+    return f"{APP_NAME} uptime: " + str(uptime)
+
+
+@app.route('/healthchecker/monitor', methods=['POST'])
+def monitorRequest():
+    # - endpoint to register an app to monitor
+    return flaskResponse(*monitorApp(request.form))
+
+
+@app.route("/healthchecker/stopmonitoring", methods=["GET"])
+def stopmonitoring():
+    # - endpoint to deregister app “stopmonitoring?<appName>”
+    return flaskResponse(*stopMonitoringApp(request.args.get('appname')))
+
+
+@app.route('/healthchecker/pause', methods=["GET"])
+def pause():
+    # - endpoint to pause monitoring “pause?<appName>”
+    return flaskResponse(*pauseApp(request.args.get('appname')))
+
+
+@app.route('/healthchecker/resume', methods=['GET'])
+def resume():
+    # - endpoint to resume monitoring “resume?<appName>"
+    return flaskResponse(*resumeApp(request.args.get('appname')))
+
+
+@app.route('/healthchecker/heartbeat', methods=['GET', 'POST'])
+def heartbeat():
+    # - endpoint for push-mode apps to send a heartbeat “heartbeat?<appName>”
+    return flaskResponse(*heartbeatApp(request.values.get('appname')))
+
+
+@app.route('/healthchecker/maintenance', methods=['POST'])
+def maintenanceRequest():
+    # schedule a maintenance window for an app or a tag
+    return flaskResponse(*addMaintenance(request.form))
+
+
+@app.route('/healthchecker/maintenance/list')
+def maintenanceList():
+    return flaskResponse(*listMaintenance())
+
+
+@app.route('/healthchecker/maintenance/cancel')
+def maintenanceCancel():
+    return flaskResponse(*cancelMaintenance(request.args.get('id', None)))
+
+
+@app.route('/healthchecker/info')
+def info():
+    # show a webpage with all the apps monitored and last status
+    return flaskResponse(*appInfo(request.args.get('appname', None)))
+
+
+@app.route('/healthchecker/export')
+def export():
+    # stream all the monitored apps and their health checks “export?format=ndjson|arrow”
+    return flaskResponse(*exportApps(request.args.get('format', 'ndjson')))
+
+
+@app.route('/healthchecker/import', methods=['POST'])
+def importRequest():
+    # bulk import of an ndjson export, read a chunk at a time
+    return flaskResponse(*importApps().feedChunks(iter(lambda: request.stream.read(64 * 1024), b'')))
+
+
 @app.route('/healthchecker/status')
 def statusPage():
-    # TODO: make this an interactive page
     # show a webpage with all the apps monitored and last status
-    return make_response(jsonify(appsMonitored), status.HTTP_501_NOT_IMPLEMENTED)
+    return flaskResponse(*statusSnapshot())
+
+
+# ---------------------
+# ASGI STUFF
+# ---------------------
+
+
+def asgiHealth(params):
+    logging.info(f"{APP_NAME} /health endpoint executing")
+    healthCheckResponse = healthResponse()
+    return healthCheckResponse.responseDict, healthCheckResponse.httpcode
+
+
+asgiApp = AsgiApp(
+    {
+        '/health': (('GET',), asgiHealth),
+        '/': (('GET',), lambda params: (f"{APP_NAME} uptime: " + str(uptime), status.HTTP_200_OK)),
+        '/healthchecker/monitor': (('POST',), monitorApp),
+        '/healthchecker/stopmonitoring': (('GET',), lambda params: stopMonitoringApp(params.get('appname'))),
+        '/healthchecker/pause': (('GET',), lambda params: pauseApp(params.get('appname'))),
+        '/healthchecker/resume': (('GET',), lambda params: resumeApp(params.get('appname'))),
+        '/healthchecker/heartbeat': (('GET', 'POST'), lambda params: heartbeatApp(params.get('appname'))),
+        '/healthchecker/info': (('GET',), lambda params: appInfo(params.get('appname'))),
+        '/healthchecker/maintenance': (('POST',), addMaintenance),
+        '/healthchecker/maintenance/list': (('GET',), lambda params: listMaintenance()),
+        '/healthchecker/maintenance/cancel': (('GET',), lambda params: cancelMaintenance(params.get('id'))),
+        '/healthchecker/status': (('GET',), lambda params: statusSnapshot()),
+        '/healthchecker/export': (('GET',), lambda params: exportApps(params.get('format', 'ndjson'))),
+        '/healthchecker/import': (('POST',), importApps, True),
+    },
+    jsonEncoder=CustomJSONEncoder,
+)
+
+
+async def serveAsgi(bindAddr, port, workers, standby):
+    # the scheduler and the api share this event loop so health checks and
+    # api calls never hand off to another thread
+    sched.start(paused=standby)
+    dispatcher.serveAsync(asyncHealthCheck, workers)
+    await heartbeats.serveUdpAsync(bindAddr, port)
+    config = uvicorn.Config(
+        asgiApp, host=bindAddr, port=port, log_level='error', lifespan='off',
+        backlog=4096, timeout_keep_alive=75,
+    )
+    await uvicorn.Server(config).serve()
 
 
 def registerService(bindAddr, port):
@@ -342,7 +1085,7 @@ def registerService(bindAddr, port):
             '_healthchecker._http._tcp.local.',
             addresses=addresses,
             port=port,
-            properties={'version': '0.9Beta', 'desc': 'health check micro-service'},
+            properties={'version': '0.9Beta', 'desc': 'health check micro-service', 'heartbeat': 'udp'},
         )
     )
     return zeroConf
@@ -355,9 +1098,14 @@ def registerService(bindAddr, port):
 @option('--gmail_token', '-gt', envvar='GMAIL_TOKEN', default='')
 @option('--bind_addr', '-ba', envvar='BIND_ADDR', default=getMyIpAddr())
 @option('--port', '-p', envvar='PORT', default=findFreePort())
+@option('--asgi', '-a', envvar='ASGI', is_flag=True, default=False)
+@option('--workers', '-w', envvar='WORKERS', type=int, default=None)
+@option('--replicate_port', '-rp', envvar='REPLICATE_PORT', type=int, default=None)
+@option('--standby_of', '-so', envvar='STANDBY_OF', default='')
+@option('--monitors', '-m', envvar='MONITORS', default='')
 @configuration_option(config_file_name=path.dirname(path.realpath(__file__)) + '/config')
-def main(verbose, test, debug, gmail_token, bind_addr, port):
-    global gmail
+def main(verbose, test, debug, gmail_token, bind_addr, port, asgi, workers, replicate_port, standby_of, monitors):
+    global gmail, sched, zeroConf, releaseJob
 
     logging.info(f'Started {APP_NAME}')
 
@@ -386,16 +1134,51 @@ def main(verbose, test, debug, gmail_token, bind_addr, port):
     # more verbose logging when this is set and use flask webserver
     logging.info(f'Debug set to {debug}')
 
-    # start the scheduler out... nothing to do right now
-    sched.start()
-
-    # register this service with zeroConf
-    zc = registerService(bind_addr, port)
+    # a warm standby follows the primary's replication log and takes over when it's gone
+    primaryAddr = None
+    if standby_of:
+        host, _, primaryPort = standby_of.rpartition(':')
+        if not host or not primaryPort.isdigit():
+            logging.error(f'`{standby_of}` is not the <ip_address>:<port> of the primary to be a standby of.')
+            exit(-1)
+        primaryAddr = (host, int(primaryPort))
+        logging.info(f'Running as a warm standby of {standby_of}.')
+
+    # the asgi server runs the api and the health checks in the same event loop
+    if asgi:
+        if uvicorn is None:
+            logging.error('`uvicorn` is required to run with --asgi.  Install it with `pip install uvicorn`.')
+            exit(-1)
+        logging.info('Running asgi server.')
+        sched = AsyncIOScheduler(job_defaults=SCHEDULER_JOB_DEFAULTS)
+        releaseJob = asyncReleaseProbe
+    else:
+        # start the scheduler out... nothing to do right now
+        sched.start(paused=primaryAddr is not None)
+        dispatcher.serve(healthCheck, workers or PROBE_WORKERS)
+        heartbeats.serveUdp(bind_addr, port)
+
+    # check the heartbeat deadlines every second
+    sched.add_job(checkHeartbeats, 'interval', seconds=1, id='_heartbeats')
+
+    if primaryAddr:
+        # the primary's declared monitors are replicated, the file is only watched once the standby takes over
+        Thread(target=followPrimary, args=(primaryAddr, bind_addr, port, replicate_port, monitors), name='standby',
+               daemon=True).start()
+    else:
+        if monitors:
+            watchMonitors(monitors)
+        if replicate_port:
+            replicationLog.serve(bind_addr, replicate_port)
+        # register this service with zeroConf
+        zeroConf = registerService(bind_addr, port)
 
     logging.info('running restapi server press Ctrl+C to exit.')
     try:
         logging.getLogger('waitress').setLevel(logging.ERROR)
-        if debug:
+        if asgi:
+            asyncio.run(serveAsgi(bind_addr, port, workers or ASYNC_PROBE_WORKERS, primaryAddr is not None))
+        elif debug:
             # run the built-in flask server
             # FOR DEVELOPMENT/DEBUGGING ONLY
             app.run(host=bind_addr, port=port, debug=False)
@@ -405,8 +1188,10 @@ def main(verbose, test, debug, gmail_token, bind_addr, port):
     except (KeyboardInterrupt, SystemExit):
         logging.info('Shutting down scheduler task.')
         sched.shutdown()
-        zc.unregister_service(logging.info)
-        zc.close()
+        replicationLog.close()
+        if zeroConf:
+            zeroConf.unregister_service(logging.info)
+            zeroConf.close()
     except (RuntimeError):
         logging.error('RuntimeError.')
 
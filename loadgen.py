@@ -0,0 +1,122 @@
+import asyncio
+import logging
+from statistics import median
+from time import perf_counter
+from urllib.parse import urlsplit
+from click import command, option, argument
+
+
+# logging format
+logging.basicConfig(
+    format="%(asctime)s-%(levelname)s: %(message)s",
+    datefmt="%d-%b %H:%M:%S",
+    level=logging.INFO,
+)
+
+
+class Connection:
+    # keep-alive HTTP/1.1 connection that reconnects when the server closes it
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = self.writer = None
+
+    async def get(self, path):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.writer.write(f'GET {path} HTTP/1.1\r\nHost: {self.host}\r\n\r\n'.encode('latin-1'))
+        await self.writer.drain()
+
+        statusCode = int((await self.reader.readline()).split()[1])
+        contentLength, keepAlive = 0, True
+        while True:
+            line = (await self.reader.readline()).strip().lower()
+            if not line:
+                break
+            if line.startswith(b'content-length:'):
+                contentLength = int(line.split(b':')[1])
+            elif line == b'connection: close':
+                keepAlive = False
+        await self.reader.readexactly(contentLength)
+
+        if not keepAlive:
+            self.close()
+        return statusCode
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+async def worker(host, port, path, count, timeout, latencies, errors):
+    connection = Connection(host, port)
+    for _ in range(count):
+        start = perf_counter()
+        try:
+            await asyncio.wait_for(connection.get(path), timeout)
+            latencies.append(perf_counter() - start)
+        except (OSError, ValueError, IndexError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            errors.append(1)
+            connection.close()
+    connection.close()
+
+
+async def openIdle(host, port, idle):
+    # connections that are opened and never used, like long-poll clients
+    connections = []
+    for _ in range(idle):
+        try:
+            connections.append(await asyncio.open_connection(host, port))
+        except OSError:
+            break
+    return connections
+
+
+async def run(url, requests, concurrency, idle, timeout):
+    parsed = urlsplit(url)
+    path = parsed.path or '/'
+    if parsed.query:
+        path += '?' + parsed.query
+
+    idleConnections = await openIdle(parsed.hostname, parsed.port or 80, idle)
+
+    latencies, errors = [], []
+    start = perf_counter()
+    await asyncio.gather(*(
+        worker(parsed.hostname, parsed.port or 80, path, requests // concurrency, timeout, latencies, errors)
+        for _ in range(concurrency)
+    ))
+    elapsed = perf_counter() - start
+
+    for _, writer in idleConnections:
+        writer.close()
+    return elapsed, sorted(latencies), len(errors), len(idleConnections)
+
+
+def percentile(values, pct):
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] if values else 0.0
+
+
+@command()
+@argument('url')
+@option('--requests', '-n', default=10000, help='total number of requests')
+@option('--concurrency', '-c', default=50, help='number of concurrent connections making requests')
+@option('--idle', '-i', default=0, help='number of idle connections held open during the run')
+@option('--timeout', '-t', default=2.0, help='seconds before a request is counted as an error')
+def main(url, requests, concurrency, idle, timeout):
+    """
+    Load generator for comparing the waitress and asgi front ends.
+
+    i.e. `python loadgen.py -n 20000 -c 100 -i 2000 http://127.0.0.1:8080/healthchecker/info?appname=myapp`
+    """
+    elapsed, latencies, errors, idleOpen = asyncio.run(run(url, requests, concurrency, idle, timeout))
+    logging.info(f'{len(latencies)} requests in {elapsed:.2f}s ({len(latencies) / elapsed:.0f} req/s), '
+                 f'{errors} errors, {idleOpen} idle connections')
+    if latencies:
+        logging.info(f'latency ms: p50={median(latencies) * 1000:.2f} p95={percentile(latencies, 95) * 1000:.2f} '
+                     f'p99={percentile(latencies, 99) * 1000:.2f} max={latencies[-1] * 1000:.2f}')
+
+
+if __name__ == '__main__':
+    main()
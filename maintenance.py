@@ -0,0 +1,193 @@
+from bisect import bisect_right
+from dataclasses import dataclass
+from itertools import count
+from math import ceil, isfinite
+from threading import Lock
+from time import time
+
+# named repeats, any other repeat is in seconds
+REPEATS = {'': 0, 'daily': 60 * 60 * 24, 'weekly': 60 * 60 * 24 * 7}
+# the shortest repeat, the occurrences of a window over the index horizon are enumerated
+MIN_REPEAT = 60
+
+
+@dataclass
+class MaintenanceWindow:
+    # a one-off (repeat 0) or recurring window for an app or every app with a tag
+    id: int
+    start: float
+    duration: float
+    repeat: float = 0
+    appname: str = None
+    tag: str = None
+
+    def scope(self):
+        return scopeOf(self.appname, self.tag)
+
+    def covers(self, now: float):
+        if now < self.start:
+            return False
+        if self.repeat:
+            return (now - self.start) % self.repeat < self.duration
+        return now < self.start + self.duration
+
+    def occurrences(self, since: float, until: float):
+        # (start, end) of every occurrence that ends after `since` and starts before `until`
+        if not self.repeat:
+            if self.start + self.duration > since:
+                yield self.start, self.start + self.duration
+            return
+        occurrence = max(0, ceil((since - self.duration - self.start) / self.repeat))
+        while self.start + occurrence * self.repeat < until:
+            start = self.start + occurrence * self.repeat
+            yield start, start + self.duration
+            occurrence += 1
+
+
+def scopeOf(appname: str = None, tag: str = None):
+    return f'app:{appname}' if appname is not None else f'tag:{tag}'
+
+
+class MaintenanceWindows:
+    """
+    Scheduled maintenance windows indexed so checking if an app is in maintenance is O(log n).
+
+    The occurrences of the windows over the next `HORIZON` seconds are kept per app and per tag sorted
+    by start with a running maximum of their ends, an app is in maintenance when the latest end of the
+    occurrences that started before now is still to come.  The index is rebuilt when windows are added
+    or removed and when the horizon is reached.
+    """
+
+    HORIZON = 60 * 60 * 24 * 7
+
+    def __init__(self):
+        self.windows = {}
+        self.ids = count(1)
+        self.lock = Lock()
+        # scope: (starts, maxEnds), replaced as a whole so readers don't need the lock
+        self.index = {}
+        self.builtFrom = self.builtUntil = None
+
+    def add(self, start: float, duration: float, appname: str = None, tag: str = None, repeat: float = 0):
+        if (appname is None) == (tag is None):
+            raise ValueError('a maintenance window is for either an `appname` or a `tag`')
+        if not (isfinite(start) and isfinite(duration) and isfinite(repeat)):
+            raise ValueError('maintenance window `start`, `duration` and `repeat` have to be finite')
+        if duration <= 0:
+            raise ValueError('maintenance window `duration` has to be positive')
+        if repeat and not max(MIN_REPEAT, duration) <= repeat:
+            raise ValueError(f'maintenance window `repeat` has to be at least {MIN_REPEAT} seconds and the `duration`')
+        with self.lock:
+            window = MaintenanceWindow(next(self.ids), start, duration, repeat, appname, tag)
+            self.windows[window.id] = window
+            self.builtUntil = None
+        return window
+
+    def restore(self, window: MaintenanceWindow):
+        # a window replicated from the primary keeps its id
+        with self.lock:
+            self.windows[window.id] = window
+            self.ids = count(max(self.windows) + 1)
+            self.builtUntil = None
+
+    def remove(self, windowId: int):
+        with self.lock:
+            self.builtUntil = None
+            return self.windows.pop(windowId, None) is not None
+
+    def list(self):
+        with self.lock:
+            return list(self.windows.values())
+
+    def until(self, appname: str, tags=(), now: float = None):
+        # end of the maintenance the app is in, None if it isn't in maintenance
+        now = time() if now is None else now
+        if self.builtUntil is None or not self.builtFrom <= now < self.builtUntil:
+            self.rebuild(now)
+        index = self.index
+        ends = [
+            self.coveringEnd(index.get(scope), now)
+            for scope in [scopeOf(appname=appname)] + [scopeOf(tag=tag) for tag in tags]
+        ]
+        return max((end for end in ends if end is not None), default=None)
+
+    @staticmethod
+    def coveringEnd(entry, now: float):
+        if entry is None:
+            return None
+        starts, maxEnds = entry
+        i = bisect_right(starts, now) - 1
+        return maxEnds[i] if i >= 0 and maxEnds[i] > now else None
+
+    def rebuild(self, now: float):
+        with self.lock:
+            until = now + MaintenanceWindows.HORIZON
+            occurrences = {}
+            for window in self.windows.values():
+                occurrences.setdefault(window.scope(), []).extend(window.occurrences(now, until))
+            index = {}
+            for scope, spans in occurrences.items():
+                spans.sort()
+                maxEnds, latest = [], float('-inf')
+                for _, end in spans:
+                    latest = max(latest, end)
+                    maxEnds.append(latest)
+                index[scope] = ([start for start, _ in spans], maxEnds)
+            self.index = index
+            self.builtFrom, self.builtUntil = now, until
+
+
+if __name__ == '__main__':
+    from random import Random
+    from time import perf_counter
+
+    # one-off and recurring windows for an app and a tag
+    windows = MaintenanceWindows()
+    day = REPEATS['daily']
+    windows.add(1000, 100, appname='app')
+    nightly = windows.add(day * 10 + 3600, 600, tag='db', repeat=day)
+    assert windows.until('app', now=1050) == 1100 and windows.until('app', now=1100) is None     # nosec
+    assert windows.until('app', ['db'], now=day * 12 + 3900) == day * 12 + 4200                 # nosec
+    assert windows.until('app', ['db'], now=day * 9 + 3900) is None                             # nosec
+    assert windows.until('app', ['db'], now=day * 400 + 3700) == day * 400 + 4200               # nosec
+    assert windows.remove(nightly.id) and windows.until('app', ['db'], now=day * 12 + 3900) is None  # nosec
+    for start, duration, repeat in ((0, float('inf'), day), (0, float('nan'), 0), (0, 10, 1e-6), (0, 7200, 3600),
+                                    (0, 10, -60), (float('inf'), 10, 0)):
+        try:
+            windows.add(start, duration, appname='app', repeat=repeat)
+            assert False, (start, duration, repeat)                                              # nosec
+        except ValueError:
+            pass
+    try:
+        windows.add(0, 10)
+        assert False                                                                             # nosec
+    except ValueError:
+        pass
+
+    # thousands of overlapping windows against checking every window
+    rand = Random(1)
+    windows = MaintenanceWindows()
+    month = day * 30
+    apps = [f'app{i}' for i in range(200)]
+    tags = [f'tag{i}' for i in range(20)]
+    appTags = {appname: rand.sample(tags, 2) for appname in apps}
+    for _ in range(5000):
+        appname, tag = (rand.choice(apps), None) if rand.random() < 0.7 else (None, rand.choice(tags))
+        repeat = rand.choices((0, day, REPEATS['weekly']), weights=(8, 1, 1))[0]
+        windows.add(rand.uniform(0, month), rand.uniform(600, 2 * 3600), appname, tag, repeat)
+
+    queries = sorted((rand.uniform(0, month), rand.choice(apps)) for _ in range(20_000))
+    start = perf_counter()
+    indexed = [windows.until(appname, appTags[appname], now) is not None for now, appname in queries]
+    indexedTime = perf_counter() - start
+    start = perf_counter()
+    scanned = [
+        any(window.covers(now) for window in windows.windows.values()
+            if window.appname == appname or window.tag in appTags[appname])
+        for now, appname in queries
+    ]
+    scanTime = perf_counter() - start
+    assert indexed == scanned                                                                    # nosec
+    print(f'{len(windows.windows)} windows, {sum(indexed)} of {len(queries)} checks in maintenance: '
+          f'indexed {indexedTime / len(queries) * 1e6:.1f}us per check (with rebuilds), '
+          f'scanning {scanTime / len(queries) * 1e6:.0f}us per check')
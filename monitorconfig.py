@@ -0,0 +1,266 @@
+import json
+import logging
+from os import stat
+from threading import Thread
+from time import sleep
+from healthcheck import monitorParams
+try:
+    import yaml  # https://pyyaml.org/
+except ImportError:
+    # only needed for `.yaml` monitor files
+    yaml = None
+try:
+    import tomllib  # python 3.11+
+except ImportError:
+    try:
+        import tomli as tomllib  # https://github.com/hukkin/tomli
+    except ImportError:
+        # only needed for `.toml` monitor files
+        tomllib = None
+
+# seconds between checks of the monitor file for changes
+WATCH_INTERVAL = 2.0
+
+
+def readMonitors(filename: str):
+    """
+    Read the monitors declared in a YAML, TOML or JSON file.
+
+    The file has a `monitors` list of tables with the same fields as `/healthchecker/monitor`, `appname`,
+    `url` and `email` are required (a monitor without an `email` fails to register).  `tags` can be a list.
+
+    Returns:
+        dict: appname to its monitor as it was declared
+    """
+    with open(filename, 'rb') as f:
+        if filename.endswith(('.yaml', '.yml')):
+            if yaml is None:
+                raise ValueError('`pyyaml` is required to read yaml monitor files.  Install it with `pip install pyyaml`.')
+            try:
+                document = yaml.load(f, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
+            except yaml.YAMLError as e:
+                raise ValueError(f'invalid yaml: {e}')
+        elif filename.endswith('.toml'):
+            if tomllib is None:
+                raise ValueError('`tomli` is required to read toml monitor files.  Install it with `pip install tomli`.')
+            document = tomllib.load(f)
+        else:
+            document = json.load(f)
+
+    monitors = {}
+    for monitor in (document or {}).get('monitors') or []:
+        if not monitor.get('appname') or not monitor.get('url'):
+            raise ValueError(f'monitor {monitor} has to have an `appname` and a `url`')
+        if monitor['appname'] in monitors:
+            raise ValueError(f"`{monitor['appname']}` is declared more than once")
+        monitors[monitor['appname']] = monitor
+    return monitors
+
+
+def monitorForm(monitor: dict):
+    # the `/healthchecker/monitor` form of a declared monitor with the defaults filled in, every value a string
+    form = monitorParams(monitor['appname'], monitor['url'])
+    for key, value in monitor.items():
+        if isinstance(value, bool):
+            value = 'true' if value else 'false'
+        elif isinstance(value, (list, tuple)):
+            value = ','.join(str(item) for item in value)
+        form[key] = value
+    return {key: str(value) for key, value in form.items()}
+
+
+class MonitorReconciler:
+    """
+    Keeps the monitors declared in a file registered, applying only what changed when the file does.
+
+    `apply(appname, form)` registers an app or brings an app's settings in line with its `/healthchecker/monitor`
+    form and returns True if it succeeded, `remove(appname)` stops monitoring an app taken out of the file.
+    The monitors are compared as they were declared so the unchanged ones cost a dict comparison.
+    Apps registered some other way (i.e. by the clients) are left alone.  Monitors that couldn't be applied
+    are tried again the next time the file changes.
+    """
+
+    def __init__(self, filename: str, apply, remove):
+        self.filename = filename
+        self.apply = apply
+        self.remove = remove
+        # the declared monitors that were applied successfully
+        self.applied = {}
+        self.version = None
+
+    def reconcile(self, monitors: dict = None):
+        """
+        Apply the changes to the monitor file since the last time.
+
+        Parameters:
+            monitors (dict): the monitors from `readMonitors()`, the file is read if they aren't given
+
+        Returns:
+            dict: the number of monitors added, changed, removed, unchanged and failed
+        """
+        monitors = readMonitors(self.filename) if monitors is None else monitors
+        counts = {'added': 0, 'changed': 0, 'removed': 0, 'unchanged': 0, 'failed': 0}
+        for appname in [appname for appname in self.applied if appname not in monitors]:
+            self.remove(appname)
+            del self.applied[appname]
+            counts['removed'] += 1
+        for appname, monitor in monitors.items():
+            applied = self.applied.get(appname)
+            if applied == monitor:
+                counts['unchanged'] += 1
+                continue
+            try:
+                ok = self.apply(appname, monitorForm(monitor))
+            except (KeyError, ValueError, TypeError) as e:
+                # i.e. `interval: 30s`, the rest of the monitors are still applied
+                logging.error(f'Monitor `{appname}` in {self.filename} is invalid: {e}')
+                ok = False
+            if ok:
+                self.applied[appname] = monitor
+                counts['added' if applied is None else 'changed'] += 1
+            else:
+                counts['failed'] += 1
+        return counts
+
+    def changed(self):
+        # the file was modified since it was last read
+        info = stat(self.filename)
+        version = (info.st_mtime_ns, info.st_size)
+        if version == self.version:
+            return False
+        self.version = version
+        return True
+
+    def watch(self, interval: float = WATCH_INTERVAL):
+        # reconcile in a daemon thread whenever the file changes, a file that can't be read leaves the monitors as they are
+        def poll():
+            while True:
+                try:
+                    if self.changed():
+                        counts = self.reconcile()
+                        logging.info(f'Reconciled monitors with {self.filename}: {counts}')
+                except (OSError, ValueError, TypeError, AttributeError) as e:
+                    logging.error(f'Could not read the monitors in {self.filename}: {e}')
+                sleep(interval)
+
+        Thread(target=poll, name='monitor-file', daemon=True).start()
+        logging.info(f'Watching {self.filename} for changes to the monitors.')
+
+
+if __name__ == '__main__':
+    import tempfile
+    from os import path
+    from time import perf_counter
+
+    def write(filename, monitors):
+        with open(filename, 'w') as f:
+            if filename.endswith('.yaml'):
+                yaml.safe_dump({'monitors': monitors}, f, sort_keys=False)
+            else:
+                json.dump({'monitors': monitors}, f)
+
+    # an app registry standing in for the server
+    registry, calls = {}, []
+
+    def apply(appname, form):
+        calls.append(('apply', appname))
+        if form['priority'] not in ('critical', 'normal', 'low'):
+            return False
+        registry[appname] = form
+        return True
+
+    def remove(appname):
+        calls.append(('remove', appname))
+        del registry[appname]
+
+    with tempfile.TemporaryDirectory() as directory:
+        filename = path.join(directory, 'monitors.json')
+        write(filename, [
+            {'appname': 'gateway', 'url': 'http://gateway', 'email': 'ops@example.com', 'tags': ['edge', 'eu']},
+            {'appname': 'db', 'url': 'http://db', 'email': 'ops@example.com', 'heartbeat': True, 'interval': 10},
+        ])
+        reconciler = MonitorReconciler(filename, apply, remove)
+        assert reconciler.reconcile()['added'] == 2                                                    # nosec
+        assert registry['gateway']['tags'] == 'edge,eu' and registry['gateway']['interval'] == '30'   # nosec
+        assert registry['db']['heartbeat'] == 'true'                                                    # nosec
+
+        # only the changes are applied, a monitor that fails is tried again
+        calls.clear()
+        write(filename, [
+            {'appname': 'gateway', 'url': 'http://gateway', 'email': 'ops@example.com', 'tags': ['edge', 'eu'],
+             'interval': 60},
+            {'appname': 'cache', 'url': 'http://cache', 'email': 'ops@example.com', 'priority': 'urgent'},
+        ])
+        counts = reconciler.reconcile()
+        assert counts == {'added': 0, 'changed': 1, 'removed': 1, 'unchanged': 0, 'failed': 1}, counts  # nosec
+        assert calls == [('remove', 'db'), ('apply', 'gateway'), ('apply', 'cache')], calls            # nosec
+        assert reconciler.reconcile()['failed'] == 1 and set(registry) == {'gateway'}                  # nosec
+        try:
+            write(filename, [{'appname': 'gateway'}])
+            reconciler.reconcile()
+            assert False                                                                               # nosec
+        except ValueError:
+            pass
+
+        # through the server's validation: a monitor with only the required fields takes the defaults
+        # and its interval is changed in place, out of range values are refused
+        import healthchecker_server as server
+        filename = path.join(directory, 'server.json')
+        minimal = {'appname': 'minimal', 'url': 'http://10.0.0.3', 'email': 'ops@example.com'}
+        write(filename, [minimal])
+        reconciler = MonitorReconciler(filename, server.applyMonitorForm, server.removeMonitor)
+        counts = reconciler.reconcile()
+        assert counts['added'] == 1 and not counts['failed'], counts                                  # nosec
+        appData = server.appsMonitored.get('minimal')
+        assert appData.timeout == 5 and appData.interval == 30                                         # nosec
+        for interval in (5, 30):
+            write(filename, [dict(minimal, interval=interval)])
+            counts = reconciler.reconcile()
+            assert counts['changed'] == 1 and not counts['failed'], counts                             # nosec
+            assert server.appsMonitored.get('minimal') is appData and appData.interval == interval     # nosec
+        write(filename, [dict(minimal, interval=1)])
+        assert reconciler.reconcile()['failed'] == 1 and appData.interval == 30                       # nosec
+        write(filename, [])
+        assert reconciler.reconcile()['removed'] == 1 and 'minimal' not in server.appsMonitored       # nosec
+
+        # a monitor that can't be applied doesn't stop the ones after it
+        write(filename, [
+            {'appname': 'bad', 'url': 'http://10.0.0.4', 'email': 'ops@example.com', 'interval': '30s'},
+            {'appname': 'noemail', 'url': 'http://10.0.0.5'},
+            {'appname': 'good', 'url': 'http://10.0.0.6', 'email': 'ops@example.com'},
+        ])
+        counts = reconciler.reconcile()
+        assert counts['added'] == 1 and counts['failed'] == 2, counts                                  # nosec
+        assert 'good' in server.appsMonitored and 'bad' not in server.appsMonitored                   # nosec
+        assert reconciler.reconcile()['failed'] == 2                                                   # nosec
+        server.stopMonitoringApp('good')
+
+        # reloading 20k monitors with a handful of changes
+        monitors = [
+            {'appname': f'app{i}', 'url': f'http://service{i % 500}.internal', 'email': 'ops@example.com',
+             'interval': (30, 10, 60)[i % 3], 'tags': [f'team{i % 40}'], 'priority': ('normal', 'critical', 'low')[i % 3]}
+            for i in range(20_000)
+        ]
+        for extension in ('json', 'yaml') if yaml else ('json',):
+            filename = path.join(directory, f'monitors.{extension}')
+            write(filename, monitors)
+            registry.clear()
+            reconciler = MonitorReconciler(filename, apply, remove)
+            reconciler.reconcile()
+            changedMonitors = [dict(monitor) for monitor in monitors]
+            changedMonitors[5]['interval'] = 300
+            changedMonitors[7001]['priority'] = 'critical'
+            changedMonitors[12000]['tags'] = ['team1', 'db']
+            del changedMonitors[15000]
+            changedMonitors.append({'appname': 'new', 'url': 'http://new.internal', 'email': 'ops@example.com'})
+            write(filename, changedMonitors)
+
+            calls.clear()
+            start = perf_counter()
+            declared = readMonitors(filename)
+            parsed = perf_counter()
+            reconciler.reconcile(declared)
+            reconciled = perf_counter()
+            assert len(calls) == 5 and len(registry) == 20_000                                          # nosec
+            print(f'{extension}: 20k monitors with 5 changes parsed in {(parsed - start) * 1000:.0f}ms, '
+                  f'diffed and applied in {(reconciled - parsed) * 1000:.1f}ms')
@@ -0,0 +1,145 @@
+from contextlib import contextmanager
+from threading import RLock
+
+
+class ProbeGroup:
+    # monitors sharing a url and timeout, `intervals` is the interval each app asked for
+    __slots__ = ('key', 'url', 'timeout', 'intervals', 'paused')
+
+    def __init__(self, key: str, url: str, timeout: int):
+        self.key = key
+        self.url = url
+        self.timeout = timeout
+        self.intervals = {}
+        self.paused = set()
+
+    def subscribers(self):
+        return [appname for appname in self.intervals if appname not in self.paused]
+
+    def interval(self):
+        # the fastest interval of the monitors that aren't paused, None if there aren't any
+        return min((interval for appname, interval in self.intervals.items() if appname not in self.paused),
+                   default=None)
+
+
+class ProbeGroups:
+    """
+    Monitors of the same url with the same timeout share a single probe whose result is fanned out to each of them.
+
+    A group is probed at the fastest interval of its monitors that aren't paused.
+    `onIntervalChange(key, before, after)` is called (holding the lock so changes are applied in order)
+    whenever that changes, `before` is None for a new group and `after` is None once no monitor needs it.
+    """
+
+    def __init__(self, onIntervalChange):
+        self.groups = {}
+        self.lock = RLock()
+        self.onIntervalChange = onIntervalChange
+
+    @staticmethod
+    def key(url: str, timeout: int):
+        return f'{url}#{timeout}'
+
+    @contextmanager
+    def changing(self, url: str, timeout: int):
+        key = ProbeGroups.key(url, timeout)
+        with self.lock:
+            group = self.groups.get(key)
+            before = group.interval() if group else None
+            if group is None:
+                group = self.groups[key] = ProbeGroup(key, url, timeout)
+            yield group
+            after = group.interval()
+            if not group.intervals:
+                del self.groups[key]
+            if before != after:
+                self.onIntervalChange(key, before, after)
+
+    def subscribe(self, appname: str, url: str, timeout: int, interval: int):
+        # also used to change the interval of a monitor
+        with self.changing(url, timeout) as group:
+            group.intervals[appname] = interval
+
+    def unsubscribe(self, appname: str, url: str, timeout: int):
+        with self.changing(url, timeout) as group:
+            group.intervals.pop(appname, None)
+            group.paused.discard(appname)
+
+    def pause(self, appname: str, url: str, timeout: int):
+        with self.changing(url, timeout) as group:
+            if appname in group.intervals:
+                group.paused.add(appname)
+
+    def resume(self, appname: str, url: str, timeout: int):
+        with self.changing(url, timeout) as group:
+            group.paused.discard(appname)
+
+    def interval(self, key: str):
+        # the interval a group is probed at, None if the group is gone
+        with self.lock:
+            group = self.groups.get(key)
+            return group.interval() if group else None
+
+    def target(self, key: str):
+        # (url, timeout, appnames) to probe for a group, None if the group is gone
+        with self.lock:
+            group = self.groups.get(key)
+            return (group.url, group.timeout, group.subscribers()) if group else None
+
+    def stats(self):
+        with self.lock:
+            intervals = [group.interval() for group in self.groups.values()]
+            return {
+                'groups': len(self.groups),
+                'monitors': sum(len(group.subscribers()) for group in self.groups.values()),
+                'probesPerHour': round(sum(3600 / interval for interval in intervals if interval)),
+                'undedupedProbesPerHour': round(sum(
+                    3600 / group.intervals[appname] for group in self.groups.values() for appname in group.subscribers()
+                )),
+            }
+
+
+if __name__ == '__main__':
+    from random import Random
+
+    changes = []
+    groups = ProbeGroups(lambda key, before, after: changes.append((key, before, after)))
+    key = ProbeGroups.key('http://gateway', 5)
+
+    # the fastest interval wins and the job only changes when it does
+    groups.subscribe('a', 'http://gateway', 5, 30)
+    groups.subscribe('b', 'http://gateway', 5, 10)
+    groups.subscribe('c', 'http://gateway', 5, 60)
+    groups.subscribe('d', 'http://gateway', 2, 60)
+    assert changes == [(key, None, 30), (key, 30, 10), ('http://gateway#2', None, 60)]     # nosec
+    assert groups.target(key) == ('http://gateway', 5, ['a', 'b', 'c'])                    # nosec
+
+    # paused monitors aren't probed
+    changes.clear()
+    groups.pause('b', 'http://gateway', 5)
+    assert changes == [(key, 10, 30)] and groups.target(key)[2] == ['a', 'c']            # nosec
+    groups.resume('b', 'http://gateway', 5)
+    groups.unsubscribe('b', 'http://gateway', 5)
+    groups.unsubscribe('a', 'http://gateway', 5)
+    groups.unsubscribe('c', 'http://gateway', 5)
+    assert changes[1:] == [(key, 30, 10), (key, 10, 30), (key, 30, 60), (key, 60, None)]   # nosec
+    assert groups.target(key) is None and len(groups.groups) == 1                          # nosec
+
+    # benchmark: a registry of 2000 monitors where most services sit behind a few gateways
+    rand = Random(1)
+    groups = ProbeGroups(lambda key, before, after: None)
+    gateways = [f'http://gateway{i}.internal' for i in range(50)]
+    for i in range(2000):
+        if rand.random() < 0.3:
+            # services with their own host
+            url = f'http://service{i}.internal'
+        else:
+            # a few gateways front most of the services
+            url = gateways[min(int(rand.paretovariate(1.2)) - 1, len(gateways) - 1)]
+        timeout = rand.choices((5, 2, 10), weights=(8, 1, 1))[0]
+        interval = rand.choices((30, 10, 60, 5), weights=(6, 2, 1, 1))[0]
+        groups.subscribe(f'app{i}', url, timeout, interval)
+    stats = groups.stats()
+    print(f"{stats['monitors']} monitors in {stats['groups']} probe groups: {stats['probesPerHour']:,} probes/hour "
+          f"instead of {stats['undedupedProbesPerHour']:,} "
+          f"({100 - 100 * stats['probesPerHour'] / stats['undedupedProbesPerHour']:.0f}% fewer)")
@@ -0,0 +1,165 @@
+from threading import RLock
+
+
+class MonitorRegistry:
+    """
+    Dictionary of monitored apps that is safe to share between api request threads and scheduler threads.
+
+    Apps are spread over `stripes` dicts each with its own lock, so calls for different apps rarely wait on
+    each other.  `lock(appname)` holds an app's stripe for compound operations (i.e. recording a health
+    check result) and iterating works on a per-stripe snapshot so readers never see a dict change size.
+    """
+
+    def __init__(self, stripes: int = 64):
+        # power of 2 so the stripe is a mask of the hash
+        self.mask = (1 << max(0, stripes - 1).bit_length()) - 1
+        self.stripes = [({}, RLock()) for _ in range(self.mask + 1)]
+
+    def stripe(self, appname: str):
+        return self.stripes[hash(appname) & self.mask]
+
+    def lock(self, appname: str):
+        return self.stripe(appname)[1]
+
+    def add(self, appname: str, appData):
+        # only adds the app if it isn't already registered, returns True if added
+        apps, lock = self.stripe(appname)
+        with lock:
+            if appname in apps:
+                return False
+            apps[appname] = appData
+            return True
+
+    def get(self, appname: str, default=None):
+        apps, lock = self.stripe(appname)
+        with lock:
+            return apps.get(appname, default)
+
+    def pop(self, appname: str, default=None):
+        apps, lock = self.stripe(appname)
+        with lock:
+            return apps.pop(appname, default)
+
+    def __getitem__(self, appname: str):
+        apps, lock = self.stripe(appname)
+        with lock:
+            return apps[appname]
+
+    def __setitem__(self, appname: str, appData):
+        apps, lock = self.stripe(appname)
+        with lock:
+            apps[appname] = appData
+
+    def __delitem__(self, appname: str):
+        apps, lock = self.stripe(appname)
+        with lock:
+            del apps[appname]
+
+    def __contains__(self, appname: str):
+        apps, lock = self.stripe(appname)
+        with lock:
+            return appname in apps
+
+    def __len__(self):
+        return sum(len(apps) for apps, _ in self.stripes)
+
+    def items(self):
+        for apps, lock in self.stripes:
+            with lock:
+                snapshot = list(apps.items())
+            yield from snapshot
+
+    def __iter__(self):
+        return (appname for appname, _ in self.items())
+
+    def snapshot(self):
+        # plain dict copy of the registry, i.e. for json
+        return dict(self.items())
+
+
+if __name__ == '__main__':
+    from threading import Thread, Lock
+    from time import perf_counter, sleep
+    from random import Random
+
+    registry = MonitorRegistry(stripes=10)
+    assert len(registry.stripes) == 16                          # nosec
+    assert registry.add('app', 1) and not registry.add('app', 2)  # nosec
+    assert registry['app'] == 1 and 'app' in registry           # nosec
+    assert list(registry) == ['app'] and len(registry) == 1     # nosec
+    assert registry.pop('app') == 1 and registry.get('app') is None  # nosec
+
+    class CheckedApp:
+        # an app's health check history that is only consistent if every update is serialized
+        def __init__(self, ioSeconds=0.0):
+            self.checks = 0
+            self.history = []
+            self.ioSeconds = ioSeconds
+
+        def record(self):
+            if self.ioSeconds:
+                # i.e. logging or sending an email while recording the result
+                sleep(self.ioSeconds)
+            self.checks += 1
+            self.history.append(self.checks)
+            if len(self.history) > 10:
+                self.history.pop(0)
+            assert self.history[-1] == self.checks              # nosec
+
+    class GlobalLockRegistry(MonitorRegistry):
+        # the same api guarded by one lock for comparison
+        def __init__(self):
+            super().__init__(stripes=1)
+
+    def stress(registry, threads=16, operations=20_000, apps=1_000, ioSeconds=0.0):
+        errors = []
+        ops = Lock()
+        counts = {'register': 0, 'remove': 0, 'probe': 0, 'missing': 0}
+
+        def worker(seed):
+            rand = Random(seed)
+            local = dict.fromkeys(counts, 0)
+            try:
+                for _ in range(operations):
+                    appname = f'app{rand.randrange(apps)}'
+                    op = rand.random()
+                    if op < 0.1:
+                        registry.add(appname, CheckedApp(ioSeconds))
+                        local['register'] += 1
+                    elif op < 0.15:
+                        registry.pop(appname)
+                        local['remove'] += 1
+                    elif op < 0.95:
+                        # probe: result recorded under the app's lock, it may have been removed
+                        with registry.lock(appname):
+                            appData = registry.get(appname)
+                            if appData is None:
+                                local['missing'] += 1
+                            else:
+                                appData.record()
+                        local['probe'] += 1
+                    else:
+                        # api reader iterating the whole registry
+                        sum(1 for _ in registry.items())
+            except Exception as e:
+                errors.append(e)
+            with ops:
+                for key, value in local.items():
+                    counts[key] += value
+
+        workers = [Thread(target=worker, args=(seed,)) for seed in range(threads)]
+        start = perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = perf_counter() - start
+        assert not errors, errors                               # nosec
+        return threads * operations / elapsed, counts
+
+    # pure python critical sections are serialized by the GIL anyway, striping pays off
+    # when the work done while holding an app's lock blocks
+    for ioSeconds, operations in ((0.0, 20_000), (0.0001, 1_000)):
+        for name, registry in (('global lock', GlobalLockRegistry()), ('striped', MonitorRegistry())):
+            throughput, counts = stress(registry, operations=operations, ioSeconds=ioSeconds)
+            print(f'{name} ({ioSeconds * 1e6:.0f}us io per probe): {throughput:,.0f} ops/sec {counts}')
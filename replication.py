@@ -0,0 +1,335 @@
+import json
+import logging
+from collections import deque
+from itertools import islice
+from socket import create_server, create_connection, timeout as SocketTimeout
+from threading import Condition, Thread
+from time import monotonic, sleep
+
+# an idle stream carries a heartbeat this often so the standby knows the primary is alive
+HEARTBEAT_INTERVAL = 0.5
+# the standby takes over when it hasn't heard from the primary for this long
+FAILOVER_TIMEOUT = 3.0
+RECONNECT_INTERVAL = 0.2
+
+HEARTBEAT_LINE = b'{"type":"heartbeat"}\n'
+RESET_LINE = b'{"type":"reset"}\n'
+
+
+class ReplicationLog:
+    """
+    The primary's log of registry changes and health check results shipped to warm standbys.
+
+    Records are ndjson lines over a plain tcp stream.  A standby that connects is sent a `reset` record
+    and a snapshot of everything (`snapshot()` generates the records) followed by the records appended
+    since the snapshot started.  The snapshot may already have some of those, so applying a record has to be
+    idempotent (i.e. skip what is older than the snapshot).  The last `size` records are
+    kept, a standby that falls further behind than that is disconnected and gets a new snapshot when it
+    reconnects.  Records are only kept while a standby is connected.
+    """
+
+    def __init__(self, snapshot, size: int = 100_000):
+        self.snapshot = snapshot
+        self.lines = deque(maxlen=size)
+        self.seq = 0
+        self.standbys = 0
+        self.closed = False
+        self.changed = Condition()
+        self.encode = json.JSONEncoder(separators=(',', ':')).encode
+
+    def append(self, record: dict):
+        if not self.standbys:
+            return
+        line = (self.encode(record) + '\n').encode('utf-8')
+        with self.changed:
+            self.lines.append(line)
+            self.seq += 1
+            self.changed.notify_all()
+
+    def close(self):
+        # stop shipping, the standbys take over once they notice
+        with self.changed:
+            self.closed = True
+            self.changed.notify_all()
+
+    def since(self, seq: int):
+        # the lines after `seq` and the last seq, None if some of them were dropped already or the log is closed
+        with self.changed:
+            if self.seq == seq and not self.closed:
+                self.changed.wait(HEARTBEAT_INTERVAL)
+            first = self.seq - len(self.lines)
+            if seq < first or self.closed:
+                return None, self.seq
+            # walked from the newest end, a standby that keeps up is only a few lines behind
+            lines = list(islice(reversed(self.lines), self.seq - seq))
+            lines.reverse()
+            return lines, self.seq
+
+    def ship(self, conn, addr):
+        # stream the snapshot and then the log to a standby until it goes away
+        with self.changed:
+            self.standbys += 1
+            seq = self.seq
+        logging.info(f'Standby {addr[0]}:{addr[1]} connected, sending snapshot.')
+        try:
+            with conn:
+                conn.sendall(RESET_LINE)
+                lines = []
+                for record in self.snapshot():
+                    lines.append((self.encode(record) + '\n').encode('utf-8'))
+                    if len(lines) >= 1000:
+                        conn.sendall(b''.join(lines))
+                        lines = []
+                conn.sendall(b''.join(lines))
+                while True:
+                    lines, seq = self.since(seq)
+                    if lines is None:
+                        if not self.closed:
+                            logging.warning(f'Standby {addr[0]}:{addr[1]} fell too far behind, disconnecting.')
+                        return
+                    conn.sendall(b''.join(lines) if lines else HEARTBEAT_LINE)
+        except OSError:
+            pass
+        finally:
+            with self.changed:
+                self.standbys -= 1
+            logging.info(f'Standby {addr[0]}:{addr[1]} disconnected.')
+
+    def serve(self, bindAddr: str, port: int):
+        # accept standbys in a daemon thread, each is shipped the log by its own thread
+        sock = create_server((bindAddr, port))
+
+        def accept():
+            while True:
+                try:
+                    conn, addr = sock.accept()
+                except OSError:
+                    return
+                Thread(target=self.ship, args=(conn, addr), name='replication-ship', daemon=True).start()
+
+        Thread(target=accept, name='replication-accept', daemon=True).start()
+        logging.info(f'Shipping the replication log to standbys from {bindAddr}:{port}')
+        return sock
+
+
+class Standby:
+    """
+    Follows the replication log of a primary, `apply(record)` is called with each record.
+
+    `follow()` returns once nothing (not even a heartbeat) has been heard from the primary for `timeout`
+    seconds, whether its connection dropped or it stopped responding, and the standby should take over.
+    """
+
+    def __init__(self, primaryAddr: tuple, apply, timeout: float = FAILOVER_TIMEOUT):
+        self.primaryAddr = primaryAddr
+        self.apply = apply
+        self.timeout = timeout
+        self.records = 0
+        self.lastHeard = None
+
+    def follow(self):
+        """
+        Apply the primary's records until the primary is gone.
+
+        Returns:
+            float: the monotonic time the primary was last heard from
+        """
+        self.lastHeard = monotonic()
+        while monotonic() - self.lastHeard < self.timeout:
+            try:
+                conn = create_connection(self.primaryAddr, timeout=self.timeout)
+            except OSError:
+                sleep(RECONNECT_INTERVAL)
+                continue
+            logging.info(f'Following the primary at {self.primaryAddr[0]}:{self.primaryAddr[1]}.')
+            try:
+                with conn:
+                    self.receive(conn)
+            except (OSError, SocketTimeout):
+                pass
+            logging.warning(f'Lost the primary at {self.primaryAddr[0]}:{self.primaryAddr[1]}.')
+        return self.lastHeard
+
+    def receive(self, conn):
+        pending = b''
+        while True:
+            data = conn.recv(256 * 1024)
+            if not data:
+                return
+            self.lastHeard = monotonic()
+            lines = (pending + data).split(b'\n')
+            pending = lines.pop()
+            for line in lines:
+                if line == HEARTBEAT_LINE[:-1]:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    logging.error(f'Dropping an invalid replication record: {line[:100]}')
+                    continue
+                self.apply(record)
+                self.records += 1
+
+
+if __name__ == '__main__':
+    import subprocess
+    import sys
+    from datetime import timedelta
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from os import path
+    from urllib.error import URLError
+    from urllib.parse import urlencode
+    from urllib.request import urlopen
+    from iputils import findFreePort
+
+    logging.basicConfig(format="%(asctime)s-%(levelname)s: %(message)s", level=logging.INFO)
+
+    # snapshot, then the log, then a reset when the standby fell behind
+    state = {'a': 1}
+    log = ReplicationLog(lambda: ({'type': 'set', 'key': key, 'value': value} for key, value in state.items()),
+                         size=10)
+    server = log.serve('127.0.0.1', 0)
+    replica, applied = {}, []
+
+    def apply(record):
+        applied.append(record['type'])
+        if record['type'] == 'reset':
+            replica.clear()
+        elif record['type'] == 'set':
+            replica[record['key']] = record['value']
+
+    standby = Standby(server.getsockname(), apply, timeout=1.0)
+    follower = Thread(target=standby.follow, daemon=True)
+    follower.start()
+    while log.standbys == 0:
+        sleep(0.01)
+    for i in range(5):
+        state[f'k{i}'] = i
+        log.append({'type': 'set', 'key': f'k{i}', 'value': i})
+    sleep(0.2)
+    assert replica == state and applied[0] == 'reset', replica                        # nosec
+
+    # a standby that falls behind gets a new snapshot
+    with log.changed:
+        for i in range(20):
+            state[f'k{i}'] = -i
+            log.append({'type': 'set', 'key': f'k{i}', 'value': -i})
+    sleep(0.5)
+    assert replica == state and applied.count('reset') == 2, replica                 # nosec
+    lines, seq = log.since(log.seq - 3)
+    assert [json.loads(line)['value'] for line in lines] == [-17, -18, -19] and seq == log.seq    # nosec
+    assert log.since(log.seq - 11)[0] is None and len(log.since(log.seq - 10)[0]) == 10           # nosec
+
+    # the primary going away is noticed within the timeout
+    server.close()
+    log.close()
+    stopped = monotonic()
+    follower.join(5)
+    assert not follower.is_alive() and 1.0 <= monotonic() - stopped < 1.5              # nosec
+
+    # the server's records: an app flapping on the primary stops flapping and is alerted on once the standby
+    # that took over keeps probing it.  The primary and standby registries are the same one in turn here
+    import healthchecker_server as server
+    server.monitorApp({
+        'appname': 'flappy', 'url': 'http://10.0.0.1', 'email': 'ops@example.com', 'timeout': '2', 'interval': '5',
+        'unhealthy_threshold': '2', 'healthy_threshold': '10',
+    })
+    primaryData = server.appsMonitored.get('flappy')
+    for check in range(10):
+        server.healthCheckResult('flappy', primaryData, 500 if check % 2 else 200)
+    assert primaryData.healthState.isFlapping()                                         # nosec
+    snapshot = json.loads(json.dumps(list(server.replicationSnapshot())))
+    for record in [{'type': 'reset'}] + snapshot:
+        server.applyReplicated(record)
+    standbyData = server.appsMonitored.get('flappy')
+    assert standbyData is not primaryData and standbyData.healthState.isFlapping()      # nosec
+    for _ in range(40):
+        server.healthCheckResult('flappy', standbyData, 500)
+    assert standbyData.healthState.state == server.Health.States.UNHEALTHY, standbyData.healthState.state  # nosec
+    server.stopMonitoringApp('flappy')
+
+    # results shipped while the snapshot was taken are already in it and aren't applied twice
+    server.replicationLog.standbys = 1
+    server.monitorApp({
+        'appname': 'steady', 'url': 'http://10.0.0.2', 'email': 'ops@example.com', 'timeout': '2', 'interval': '5',
+        'unhealthy_threshold': '2', 'healthy_threshold': '10',
+    })
+    primaryData = server.appsMonitored.get('steady')
+    for _ in range(3):
+        server.healthCheckResult('steady', primaryData, 200)
+    snapshot = json.loads(json.dumps(list(server.replicationSnapshot())))
+    results = [json.loads(line) for line in server.replicationLog.lines if b'"type":"result"' in line]
+    for record in [{'type': 'reset'}] + snapshot + results:
+        server.applyReplicated(record)
+    standbyData = server.appsMonitored.get('steady')
+    assert len(results) == 3 and len(standbyData.healthchecks) == 3                     # nosec
+    assert standbyData.lastcheck == primaryData.lastcheck                               # nosec
+    assert standbyData.availability.report() == server.AppData().availability.report()  # nosec
+    newer = dict(results[-1], time=(primaryData.lastcheck + timedelta(seconds=5)).isoformat())
+    server.applyReplicated(newer)
+    assert len(standbyData.healthchecks) == 4                                           # nosec
+    server.stopMonitoringApp('steady')
+    server.replicationLog.standbys = 0
+
+    # two local servers: kill the primary and time how long until the standby probes the app
+    here = path.dirname(path.realpath(__file__))
+    appPort, primaryPort, standbyPort, replicationPort = (findFreePort() for _ in range(4))
+
+    class HealthyApp(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    Thread(target=ThreadingHTTPServer(('127.0.0.1', appPort), HealthyApp).serve_forever, daemon=True).start()
+
+    def startServer(port, *args):
+        # `--asgi` for the probe counters in `/health`
+        return subprocess.Popen(
+            [sys.executable, path.join(here, 'healthchecker_server.py'), '-ba', '127.0.0.1', '-p', str(port), '-a',
+             *args],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+
+    def get(port, endpoint):
+        try:
+            with urlopen(f'http://127.0.0.1:{port}/{endpoint}') as response:
+                return json.load(response)
+        except (URLError, OSError, ValueError):
+            return None
+
+    def probed(port):
+        health = get(port, 'health')
+        return health and sum(health['probeDispatcher'][priority]['probed'] for priority in ('critical', 'normal', 'low'))
+
+    primary = startServer(primaryPort, '--replicate_port', str(replicationPort))
+    standbyServer = startServer(standbyPort, '--standby_of', f'127.0.0.1:{replicationPort}')
+    try:
+        sleep(3)
+        form = urlencode({
+            'appname': 'app', 'url': f'http://127.0.0.1:{appPort}', 'email': 'ops@example.com', 'timeout': 2,
+            'interval': 5, 'unhealthy_threshold': 2, 'healthy_threshold': 2,
+        }).encode()
+        urlopen(f'http://127.0.0.1:{primaryPort}/healthchecker/monitor', data=form).close()
+        sleep(12)
+        replicated = get(standbyPort, 'healthchecker/info?appname=app')
+        assert replicated['healthState']['currentHealth'] == 'HEALTHY' and not probed(standbyPort)  # nosec
+        print(f"standby has `app` {replicated['healthState']['currentHealth']} after "
+              f"{replicated['availability']['outages']} outages and {len(replicated['healthchecks'])} health checks "
+              f"without probing it")
+
+        primary.kill()
+        killed = monotonic()
+        while not probed(standbyPort) and monotonic() - killed < 30:
+            sleep(0.05)
+        failover = monotonic() - killed
+        assert get(standbyPort, 'healthchecker/info?appname=app')['healthState']['currentHealth'] == 'HEALTHY'  # nosec
+        print(f'standby took over and probed `app` {failover:.2f}s after the primary was killed '
+              f'(failover timeout {FAILOVER_TIMEOUT}s)')
+        assert failover < FAILOVER_TIMEOUT + 2                                             # nosec
+    finally:
+        primary.kill()
+        standbyServer.kill()
@@ -0,0 +1,313 @@
+import json
+import logging
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from itertools import groupby
+from random import Random
+from statistics import median
+from time import perf_counter
+from click import command, option, File
+from healthcheck import MonitorValues
+from statemachine import Health
+
+# logging format
+logging.basicConfig(
+    format="%(asctime)s-%(levelname)s: %(message)s",
+    datefmt="%d-%b %H:%M:%S",
+    level=logging.INFO,
+)
+
+SECONDS_PER_DAY = 60 * 60 * 24
+UNKNOWN, HEALTHY, DEGRADING, UNHEALTHY = (Health.States.UNKNOWN, Health.States.HEALTHY,
+                                          Health.States.DEGRADING, Health.States.UNHEALTHY)
+
+
+class Trace:
+    """
+    What a health check would have returned every `resolution` seconds and the real outages in that time.
+
+    A health check every `interval` seconds sees every `interval / resolution` sample, the samples are
+    replayed as runs of the same result since the statemachine settles within a couple of checks of a run.
+    """
+
+    def __init__(self, up: bytearray, resolution: int, outages: list):
+        self.up = up
+        self.resolution = resolution
+        # sorted (start, end) seconds
+        self.outages = outages
+
+    def days(self):
+        return len(self.up) * self.resolution / SECONDS_PER_DAY
+
+    def runs(self, interval: int):
+        # (time of the first check, number of checks, up) of every run of the same health check result
+        step = interval // self.resolution
+        runs, index = [], 0
+        for up, checks in groupby(self.up[::step]):
+            length = sum(1 for _ in checks)
+            runs.append((index * interval, length, up))
+            index += length
+        return runs
+
+    def checks(self, interval: int):
+        # (time, up) of every health check
+        return [(index * interval, up) for index, up in enumerate(self.up[::interval // self.resolution])]
+
+
+def syntheticTrace(days: float, resolution: int, outagesPerDay: float, outageMinutes: float, blipRate: float,
+                   seed: int = None):
+    """
+    Trace with outages at random times (log-normal durations with a median of `outageMinutes`) and
+    single failed health checks (blips) at `blipRate` of the samples that aren't outages.
+    """
+    rand = Random(seed)
+    samples = int(days * SECONDS_PER_DAY / resolution)
+    up = bytearray(b'\x01') * samples
+    for i in range(samples):
+        if rand.random() < blipRate:
+            up[i] = 0
+
+    outages, t = [], rand.expovariate(outagesPerDay / SECONDS_PER_DAY) if outagesPerDay else samples * resolution
+    while t < samples * resolution:
+        duration = rand.lognormvariate(0, 1) * outageMinutes * 60
+        start, end = int(t // resolution), min(samples, int((t + duration) // resolution) + 1)
+        up[start:end] = bytes(end - start)
+        outages.append((start * resolution, end * resolution))
+        t += duration + rand.expovariate(outagesPerDay / SECONDS_PER_DAY)
+    return Trace(up, resolution, mergeOutages(outages))
+
+
+def recordedTrace(lines, appname: str = None, minOutage: float = 60):
+    """
+    Trace from the health checks of an ndjson export (`/healthchecker/export`).
+
+    The resolution is the median time between checks, gaps keep the last result and failures
+    lasting at least `minOutage` seconds are taken to be the real outages.
+    """
+    checks = []
+    for line in lines:
+        record = json.loads(line) if line.strip() else {}
+        if record.get('type') == 'check' and (appname is None or record['appname'] == appname):
+            checks.append((datetime.fromisoformat(record['time']).timestamp(), record['statusCode'] == 200))
+    if len(checks) < 2:
+        raise ValueError(f'not enough health checks in the history for `{appname}`')
+    checks.sort()
+
+    resolution = max(1, round(median(b[0] - a[0] for a, b in zip(checks, checks[1:]))))
+    start = checks[0][0]
+    up = bytearray(int((checks[-1][0] - start) // resolution) + 1)
+    index, previous = 0, checks[0][1]
+    for checkTime, healthy in checks:
+        checkIndex = int((checkTime - start) // resolution)
+        up[index:checkIndex] = bytes([previous]) * (checkIndex - index)
+        up[checkIndex] = healthy
+        index, previous = max(index, checkIndex + 1), healthy
+
+    outages, index = [], 0
+    for healthy, samples in groupby(up):
+        length = sum(1 for _ in samples)
+        if not healthy and length * resolution >= minOutage:
+            outages.append((index * resolution, (index + length) * resolution))
+        index += length
+    return Trace(up, resolution, outages)
+
+
+def mergeOutages(outages):
+    merged = []
+    for start, end in sorted(outages):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def replay(runs, interval: int, unhealthyThreshold: int, healthyThreshold: int):
+    """
+    Replay runs of health check results through the `Health` statemachine rules in O(1) per run.
+
+    Returns:
+        tuple: (degraded, unhealthy, healthy) lists of the times the statemachine entered each state
+    """
+    state, unhealthyChecks, healthyChecks = UNKNOWN, 0, 0
+    degraded, unhealthy, healthy = [], [], []
+    for start, length, up in runs:
+        if up:
+            if state == HEALTHY:
+                continue
+            # `healthyCheck` counts up to the threshold then resets the unhealthy count
+            check = max(1, healthyThreshold - healthyChecks)
+            if check <= length:
+                healthy.append(start + (check - 1) * interval)
+                state, unhealthyChecks, healthyChecks = HEALTHY, 0, healthyThreshold
+            else:
+                healthyChecks += length
+            continue
+
+        if state == UNHEALTHY:
+            continue
+        # `unhealthyCheck` counts up to the threshold (a healthy app's count is only reset by going HEALTHY)
+        firstCheck = 1
+        if state != DEGRADING:
+            check = max(1, 2 - unhealthyChecks)
+            if check > length:
+                unhealthyChecks += length
+                continue
+            degraded.append(start + (check - 1) * interval)
+            state, firstCheck = DEGRADING, check + 1
+        check = max(firstCheck, unhealthyThreshold - unhealthyChecks)
+        if check <= length:
+            unhealthy.append(start + (check - 1) * interval)
+            state, unhealthyChecks, healthyChecks = UNHEALTHY, unhealthyThreshold, 0
+        else:
+            unhealthyChecks = min(unhealthyThreshold, unhealthyChecks + length)
+            if unhealthyChecks >= unhealthyThreshold:
+                healthyChecks = 0
+    return degraded, unhealthy, healthy
+
+
+def score(outages, days: float, interval: int, degraded, unhealthy, healthy):
+    # detection and recovery latency of the outages and the alarms outside of them
+    starts = [start for start, _ in outages]
+    detected, detectLatency, recoverLatency = 0, 0.0, 0.0
+    falseAlarms = falseDegraded = 0
+    for times, isAlarm in ((unhealthy, True), (degraded, False)):
+        for t in times:
+            i = bisect_right(starts, t) - 1
+            if i < 0 or t > outages[i][1] + interval:
+                if isAlarm:
+                    falseAlarms += 1
+                else:
+                    falseDegraded += 1
+
+    for start, end in outages:
+        # the first time the app went UNHEALTHY during the outage
+        i = bisect_left(unhealthy, start)
+        if i == len(unhealthy) or unhealthy[i] > end + interval:
+            continue
+        detected += 1
+        detectLatency += unhealthy[i] - start
+        j = bisect_left(healthy, end)
+        if j < len(healthy):
+            recoverLatency += healthy[j] - end
+
+    return {
+        'detected': detected,
+        'missed': len(outages) - detected,
+        'detectLatency': detectLatency / detected if detected else None,
+        'recoverLatency': recoverLatency / detected if detected else None,
+        'falseAlarmsPerDay': falseAlarms / days,
+        'falseDegradedPerDay': falseDegraded / days,
+        'probesPerDay': SECONDS_PER_DAY / interval,
+    }
+
+
+def sweep(trace: Trace, intervals, unhealthyThresholds, healthyThresholds):
+    # every combination of the parameters, the runs of each interval are shared by all of its thresholds
+    results = []
+    for interval in intervals:
+        runs = trace.runs(interval)
+        for unhealthyThreshold in unhealthyThresholds:
+            for healthyThreshold in healthyThresholds:
+                result = score(trace.outages, trace.days(), interval,
+                               *replay(runs, interval, unhealthyThreshold, healthyThreshold))
+                result.update(interval=interval, unhealthy=unhealthyThreshold, healthy=healthyThreshold)
+                results.append(result)
+    return results
+
+
+def verifyReplay(trace: Trace, interval: int, unhealthyThreshold: int, healthyThreshold: int, checks: int):
+    # the replay has to enter the same states at the same times as the real statemachine
+    health = Health(unhealthyThreshold=unhealthyThreshold, healthyThreshold=healthyThreshold)
+    expected = ([], [], [])
+    for t, up in trace.checks(interval)[:checks]:
+        before = health.state
+        health.healthyCheck() if up else health.unhealthyCheck()
+        if health.state != before:
+            expected[(DEGRADING, UNHEALTHY, HEALTHY).index(health.state)].append(t)
+
+    end = checks * interval
+    runs = [(start, min(length, (end - start) // interval), up) for start, length, up in trace.runs(interval)
+            if start < end]
+    return replay(runs, interval, unhealthyThreshold, healthyThreshold) == expected
+
+
+def parseRange(value: str):
+    # `2-10` or `5-300:5`
+    bounds, _, step = value.partition(':')
+    low, _, high = bounds.partition('-')
+    return range(int(low), int(high or low) + 1, int(step or 1))
+
+
+def formatSeconds(seconds):
+    return '-' if seconds is None else f'{seconds:.0f}s'
+
+
+@command()
+@option('--history', type=File('r'), help='ndjson export to replay instead of a synthetic trace')
+@option('--appname', help='app in the history to replay')
+@option('--min-outage', default=60.0, help='seconds of failures in the history that count as an outage')
+@option('--days', default=30.0, help='length of the synthetic trace')
+@option('--resolution', default=5, help='seconds between samples of the synthetic trace')
+@option('--outages-per-day', default=0.5, help='synthetic outages per day')
+@option('--outage-minutes', default=10.0, help='median length of a synthetic outage')
+@option('--blip-rate', default=0.001, help='fraction of synthetic samples that are single failed checks')
+@option('--seed', default=1, help='random seed of the synthetic trace')
+# the server's valid ranges by default
+@option('--intervals', default=f'{MonitorValues.MIN_INTERVAL}-{MonitorValues.MAX_INTERVAL}:{MonitorValues.MIN_INTERVAL}',
+        help='health check intervals to try, `low-high[:step]` seconds')
+@option('--unhealthy', default=f'{MonitorValues.MIN_UNHEALTHY_THRESHOLD}-{MonitorValues.MAX_UNHEALTHY_THRESHOLD}',
+        help='unhealthy thresholds to try')
+@option('--healthy', default=f'{MonitorValues.MIN_HEALTHY_THRESHOLD}-{MonitorValues.MAX_HEALTHY_THRESHOLD}',
+        help='healthy thresholds to try')
+@option('--max-false-alarms', default=0.1, help='false UNHEALTHY alarms per day allowed')
+@option('--top', default=20, help='number of settings to show')
+@option('--verify', default=0, help='check this many health checks of each interval against the statemachine')
+def main(history, appname, min_outage, days, resolution, outages_per_day, outage_minutes, blip_rate, seed,
+         intervals, unhealthy, healthy, max_false_alarms, top, verify):
+    """
+    Replay a health check history (or a synthetic one) through the statemachine for every combination of
+    interval, unhealthy and healthy threshold, and show the settings that detect outages fastest.
+
+    i.e. `python simulator.py --days 30 --intervals 5-300:5 --unhealthy 2-10 --healthy 2-10`
+    """
+    start = perf_counter()
+    if history:
+        trace = recordedTrace(history, appname, min_outage)
+    else:
+        trace = syntheticTrace(days, resolution, outages_per_day, outage_minutes, blip_rate, seed)
+    # intervals have to be a multiple of the trace resolution
+    intervals = sorted({max(1, round(i / trace.resolution)) * trace.resolution for i in parseRange(intervals)})
+    unhealthy, healthy = parseRange(unhealthy), parseRange(healthy)
+    logging.info(f'{trace.days():.1f} days at {trace.resolution}s resolution with {len(trace.outages)} outages '
+                 f'in {perf_counter() - start:.2f}s')
+
+    if verify:
+        for interval in intervals:
+            for unhealthyThreshold in unhealthy:
+                for healthyThreshold in healthy:
+                    if not verifyReplay(trace, interval, unhealthyThreshold, healthyThreshold, verify):
+                        raise AssertionError(f'replay differs from the statemachine for interval={interval} '
+                                             f'unhealthy={unhealthyThreshold} healthy={healthyThreshold}')
+        logging.info(f'replay matches the statemachine for the first {verify} health checks')
+
+    start = perf_counter()
+    results = sweep(trace, intervals, unhealthy, healthy)
+    logging.info(f'{len(results)} settings replayed in {perf_counter() - start:.2f}s')
+
+    # fewest missed outages and fastest detection without too many false alarms, then the fewest probes
+    acceptable = [result for result in results if result['falseAlarmsPerDay'] <= max_false_alarms]
+    acceptable.sort(key=lambda r: (r['missed'], r['detectLatency'] or float('inf'), r['probesPerDay']))
+    print(f"{'interval':>8} {'unhealthy':>9} {'healthy':>7} {'detected':>8} {'missed':>6} {'detect':>7} "
+          f"{'recover':>7} {'false/day':>9} {'degraded/day':>12} {'probes/day':>10}")
+    for result in acceptable[:top]:
+        print(f"{result['interval']:>8} {result['unhealthy']:>9} {result['healthy']:>7} {result['detected']:>8} "
+              f"{result['missed']:>6} {formatSeconds(result['detectLatency']):>7} "
+              f"{formatSeconds(result['recoverLatency']):>7} {result['falseAlarmsPerDay']:>9.2f} "
+              f"{result['falseDegradedPerDay']:>12.2f} {result['probesPerDay']:>10.0f}")
+    if not acceptable:
+        print(f'No settings with at most {max_false_alarms} false alarms per day.')
+
+
+if __name__ == '__main__':
+    main()
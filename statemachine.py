@@ -12,6 +12,7 @@ class Health(object):
         HEALTHY = 1
         DEGRADING = 2
         UNHEALTHY = 3
+        FLAPPING = 4
 
         def __str__(self):
             return str(self.value)
@@ -50,6 +51,30 @@ class Health(object):
             conditions='isDegrading'
         )
 
+        # responding, but too slowly
+        self.machine.add_transition(
+            trigger='degradedCheck',
+            source=[Health.States.UNKNOWN, Health.States.HEALTHY],
+            dest=Health.States.DEGRADING,
+            prepare='resetHealthy'
+        )
+        self.machine.add_transition(
+            trigger='degradedCheck', source=[Health.States.DEGRADING, Health.States.UNHEALTHY], dest=None,
+            prepare='resetHealthy'
+        )
+
+        # oscillating too often, health checks are ignored (and notifications suppressed) until it settles
+        self.machine.add_transition(
+            trigger='startFlapping',
+            source=[Health.States.UNKNOWN, Health.States.HEALTHY, Health.States.DEGRADING, Health.States.UNHEALTHY],
+            dest=Health.States.FLAPPING
+        )
+        self.machine.add_transition(
+            trigger='stopFlapping', source=Health.States.FLAPPING, dest=Health.States.UNKNOWN, before='resetChecks'
+        )
+        for trigger in ('healthyCheck', 'unhealthyCheck', 'degradedCheck'):
+            self.machine.add_transition(trigger=trigger, source=Health.States.FLAPPING, dest=None)
+
         self.machine.add_transition(trigger='unknown', source=Health.States, dest=Health.States.UNKNOWN)
 
         # self.machine.get_graph().draw('my_state_diagram.png', prog='dot')
@@ -66,6 +91,8 @@ class Health(object):
             self.machine.on_exit_HEALTHY(lambda: print(f'Exiting HEALTHY: HC={self.healthyChecks} UHC={self.unhealthyChecks}'))
             self.machine.on_enter_UNHEALTHY(lambda: print('Entering UNHEALTHY'))
             self.machine.on_exit_UNHEALTHY(lambda: print(f'Exiting UNHEALTHY: HC={self.healthyChecks} UHC={self.unhealthyChecks}'))
+            self.machine.on_enter_FLAPPING(lambda: print('Entering FLAPPING'))
+            self.machine.on_exit_FLAPPING(lambda: print('Exiting FLAPPING'))
         else:
             # Set transitions' log level to ERROR so only important msgs appear
             logging.getLogger('transitions').setLevel(logging.ERROR)
@@ -73,14 +100,21 @@ class Health(object):
     def registerEmail(self, appname, emailAddr, emailCallback):
         self.emailAddr = emailAddr
 
-        # set up state on_enters to email callback
-        self.machine.on_enter_DEGRADING(
-            lambda: emailCallback(
+        # degrading has its own email for failed and for slow health checks
+        for transition in self.machine.get_transitions('unhealthyCheck', dest=Health.States.DEGRADING):
+            transition.add_callback('after', lambda: emailCallback(
                 sendTo=emailAddr,
                 messageBody=f"`{appname}` has not responded to the last two health checks.",
                 emailSubject=f"`{appname}` health is degraded"
-            )
-        )
+            ))
+        for transition in self.machine.get_transitions('degradedCheck', dest=Health.States.DEGRADING):
+            transition.add_callback('after', lambda: emailCallback(
+                sendTo=emailAddr,
+                messageBody=f"`{appname}` is responding to health checks, but over its time to first byte threshold.",
+                emailSubject=f"`{appname}` is responding slowly"
+            ))
+
+        # set up state on_enters to email callback
         self.machine.on_enter_HEALTHY(
             lambda: emailCallback(
                 sendTo=emailAddr,
@@ -95,6 +129,13 @@ class Health(object):
                 emailSubject=f"`{appname}` is unhealthy"
             )
         )
+        self.machine.on_enter_FLAPPING(
+            lambda: emailCallback(
+                sendTo=emailAddr,
+                messageBody=f"`{appname}` keeps changing health, no more emails will be sent until it settles.",
+                emailSubject=f"`{appname}` is flapping"
+            )
+        )
 
     def incrementUnhealthy(self):
         self.unhealthyChecks += 1 if not self.isUnhealthy() else 0
@@ -106,6 +147,21 @@ class Health(object):
         if self.isHealthy():
             self.unhealthyChecks = 0
 
+    def resetHealthy(self):
+        self.healthyChecks = 0
+
+    def resetChecks(self):
+        self.healthyChecks = self.unhealthyChecks = 0
+
+    def restore(self, state: str, healthyChecks: int, unhealthyChecks: int):
+        # the state replicated from the primary, set without running the transitions (or sending emails)
+        self.machine.set_state(Health.States[state], model=self)
+        self.healthyChecks = healthyChecks
+        self.unhealthyChecks = unhealthyChecks
+
+    def isFlapping(self):
+        return self.state == Health.States.FLAPPING
+
     def isUnhealthy(self):
         return self.unhealthyChecks >= self.unhealthyThreshold
 
@@ -183,4 +239,50 @@ if __name__ == '__main__':
     # test transition UNKNOWN -> UNHEALTHY state
     healthState.unhealthyCheck()
     healthState.unhealthyCheck()
-    assert healthState.state == Health.States.DEGRADING                     #nosec
\ No newline at end of file
+    assert healthState.state == Health.States.DEGRADING                     #nosec
+
+    # test transition HEALTHY -> DEGRADING state on a slow check
+    healthState.unknown()
+    healthState.healthyChecks = healthState.unhealthyChecks = 0
+    for _ in range(4):
+        healthState.healthyCheck()
+    assert healthState.state == Health.States.HEALTHY                       #nosec
+    healthState.degradedCheck()
+    assert healthState.state == Health.States.DEGRADING                     #nosec
+    assert healthState.healthyChecks == 0                                   #nosec
+
+    # it takes `healthyThreshold` checks to get back to HEALTHY
+    healthState.healthyCheck()
+    assert healthState.state == Health.States.DEGRADING                     #nosec
+    for _ in range(3):
+        healthState.healthyCheck()
+    assert healthState.state == Health.States.HEALTHY                       #nosec
+
+    # test flapping, health checks are ignored until it settles
+    healthState.degradedCheck()
+    healthState.startFlapping()
+    assert healthState.isFlapping()                                         #nosec
+    healthState.unhealthyCheck()
+    healthState.unhealthyCheck()
+    healthState.healthyCheck()
+    healthState.degradedCheck()
+    assert healthState.isFlapping()                                         #nosec
+
+    # settling starts again from UNKNOWN
+    healthState.stopFlapping()
+    assert healthState.state == Health.States.UNKNOWN                       #nosec
+    assert healthState.healthyChecks == healthState.unhealthyChecks == 0    #nosec
+    for _ in range(4):
+        healthState.healthyCheck()
+    assert healthState.state == Health.States.HEALTHY                       #nosec
+
+    # degrading on failed checks and on slow checks send different emails
+    emails = []
+    healthState = Health(unhealthyThreshold=4, healthyThreshold=4)
+    healthState.registerEmail('app', 'me@example.com', lambda **email: emails.append(email['emailSubject']))
+    healthState.unhealthyCheck()
+    healthState.unhealthyCheck()
+    healthState.unknown()
+    healthState.degradedCheck()
+    healthState.degradedCheck()
+    assert emails == ['`app` health is degraded', '`app` is responding slowly'], emails    #nosec